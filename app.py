@@ -8,9 +8,11 @@ import time
 from pathlib import Path
 from typing import Dict, List
 
+import numpy as np
 import streamlit as st
 
 from libs.tidb_ops import TiDBOps
+from libs.ui_common import missing_dialog, validate_sid
 
 
 # =========================
@@ -24,8 +26,9 @@ TIDB_DATABASE = st.secrets.get("TIDB_DATABASE", "github_sample")
 LOCK_TTL_SECONDS = int(st.secrets.get("LOCK_TTL_SECONDS", 7200))
 QUESTIONS_PER_PAGE = int(st.secrets.get("QUESTIONS_PER_PAGE", 20))
 
-def validate_sid(sid: str) -> bool:
-    return sid.isdigit() and len(sid) == 10
+# 下拉框选项固定不变：模块级常量，选项 -> answer_arr 编码（-1 未作答，0/1/2 = A/B/C）
+ANSWER_CHOICES = ("（未选择）", "A", "B", "C")
+CHOICE_CODE = {c: i - 1 for i, c in enumerate(ANSWER_CHOICES)}
 
 
 @st.cache_resource
@@ -53,35 +56,6 @@ def get_db():
     )
 
 
-# --- dialog compatibility ---
-DIALOG_DECORATOR = getattr(st, "dialog", None) or getattr(st, "experimental_dialog", None)
-
-if DIALOG_DECORATOR:
-    @DIALOG_DECORATOR("⚠️ 还有题目未作答")
-    def missing_dialog(missing_numbers: List[int], first_missing_page: int):
-        st.warning("请先完成以下题目再提交：")
-        if len(missing_numbers) <= 200:
-            st.write("未作答题号：", ", ".join(map(str, missing_numbers)))
-        else:
-            st.write("未作答题号（前200题）：", ", ".join(map(str, missing_numbers[:200])))
-            st.caption(f"（共 {len(missing_numbers)} 题未作答，已省略后续题号）")
-
-        c1, c2 = st.columns([1, 1])
-        with c1:
-            if st.button("跳转到第一题未做"):
-                st.session_state["page"] = first_missing_page
-                st.rerun()
-        with c2:
-            if st.button("继续作答"):
-                st.rerun()
-else:
-    def missing_dialog(missing_numbers: List[int], first_missing_page: int):
-        st.warning("还有题目未作答： " + ", ".join(map(str, missing_numbers[:200])))
-        if st.button("跳转到第一题未做"):
-            st.session_state["page"] = first_missing_page
-            st.rerun()
-
-
 # =========================
 # State helpers
 # =========================
@@ -89,7 +63,7 @@ def clear_questionnaire_state(keep_sid: bool = True):
     sid = st.session_state.get("sid") if keep_sid else None
     for k in [
         "qid", "bank", "rel_path", "payload", "questions",
-        "answers", "page", "started_at",
+        "qid_index", "qid_keys", "question_md", "answer_arr", "page", "started_at", "last_lock_refresh",
         "show_missing_dialog", "missing_numbers", "missing_first_page",
     ]:
         st.session_state.pop(k, None)
@@ -97,6 +71,28 @@ def clear_questionnaire_state(keep_sid: bool = True):
         st.session_state["sid"] = sid
 
 
+def build_question_markdown(i: int, q: dict) -> str:
+    """
+    把一道题的分隔线/标题/题干/选项拼成一段 markdown（段落之间空行分隔，长文本自动换行）。
+    选项完整文本放在题目中展示（避免下拉框截断）；每题只产生 1 个文本元素 + 1 个下拉框。
+    """
+    opt_map = {o.get("key"): o.get("text", "") for o in q.get("options", [])}
+    a_text = opt_map.get("A", "")
+    b_text = opt_map.get("B", "")
+    c_text = opt_map.get("C", "")  # 通常是“差不多”
+
+    parts = ["---", f"### 题目 {i+1}"]
+    prompt = q.get("prompt", "")
+    if prompt:
+        parts.append(prompt)
+    parts += [
+        "**选项 A：**", a_text if a_text else "（空）",
+        "**选项 B：**", b_text if b_text else "（空）",
+        "**选项 C：**", c_text if c_text else "（空）",
+    ]
+    return "\n\n".join(parts)
+
+
 def start_doing_from_row(row):
     payload = row.payload
     questions = payload.get("questions", [])
@@ -105,9 +101,16 @@ def start_doing_from_row(row):
     st.session_state["rel_path"] = row.rel_path
     st.session_state["payload"] = payload
     st.session_state["questions"] = questions
-    st.session_state["answers"] = {}  # qid -> "A"/"B"/"C"
+    # 作答用定长数组存储：answer_arr[i] = -1 未作答，0/1/2 对应 A/B/C
+    qid_keys = [q.get("qid", f"q{i}") for i, q in enumerate(questions)]
+    st.session_state["qid_keys"] = qid_keys
+    st.session_state["qid_index"] = {k: i for i, k in enumerate(qid_keys)}
+    # 题目展示文本只依赖题目本身，领取时一次性拼好，避免每次 rerun 重复构建
+    st.session_state["question_md"] = [build_question_markdown(i, q) for i, q in enumerate(questions)]
+    st.session_state["answer_arr"] = np.full(len(questions), -1, dtype=np.int8)
     st.session_state["page"] = 0
     st.session_state["started_at"] = time.time()
+    st.session_state["last_lock_refresh"] = time.time()  # claim_one 已设置好 lock_expires_at
     st.session_state["stage"] = "doing"
 
 
@@ -163,7 +166,9 @@ elif stage == "doing":
     sid = st.session_state.get("sid", "")
     qid = st.session_state.get("qid", "")
     questions = st.session_state.get("questions", [])
-    answers: Dict[str, str] = st.session_state.get("answers", {})
+    answer_arr: np.ndarray = st.session_state.get("answer_arr", np.full(len(questions), -1, dtype=np.int8))
+    question_md: List[str] = st.session_state.get("question_md", [])
+    qid_keys: List[str] = st.session_state.get("qid_keys", [])
 
     if not sid or not qid:
         st.error("会话状态异常：缺少 sid 或 qid。请重新领取问卷。")
@@ -172,12 +177,16 @@ elif stage == "doing":
         st.rerun()
 
     # 续租 TTL：如果失败（可能已过期被回收），强制回到首页
-    ok = db.refresh_lock(qid=qid, sid=sid, ttl_seconds=LOCK_TTL_SECONDS)
-    if not ok:
-        st.error("该问卷已过期或不再属于你（可能超时被系统回收）。请重新领取。")
-        clear_questionnaire_state(keep_sid=True)
-        st.session_state["stage"] = "login"
-        st.rerun()
+    # 每次 rerun 都续租会产生一次数据库往返；距上次续租不足 TTL/4 时跳过，TTL 仍足以覆盖崩溃场景
+    now = time.time()
+    if now - float(st.session_state.get("last_lock_refresh", 0.0)) > LOCK_TTL_SECONDS / 4:
+        ok = db.refresh_lock(qid=qid, sid=sid, ttl_seconds=LOCK_TTL_SECONDS)
+        if not ok:
+            st.error("该问卷已过期或不再属于你（可能超时被系统回收）。请重新领取。")
+            clear_questionnaire_state(keep_sid=True)
+            st.session_state["stage"] = "login"
+            st.rerun()
+        st.session_state["last_lock_refresh"] = now
 
     # 缺题弹窗触发
     if st.session_state.get("show_missing_dialog", False):
@@ -207,61 +216,31 @@ elif stage == "doing":
     start = page * per
     end = min(total, start + per)
 
-    answered = sum(1 for q in questions if q.get("qid") in answers)
+    answered = int((answer_arr >= 0).sum())
     st.write(f"页进度：第 {page+1}/{page_count} 页（本页 {start+1}-{end} / 总 {total} 题）")
     st.write(f"总体进度：已完成 {answered}/{total} 题")
     st.progress(answered / total if total else 0.0)
 
     with st.form(key="qa_form"):
         for i in range(start, end):
-            q = questions[i]
-            q_qid = q.get("qid", f"q{i}")
-            prompt = q.get("prompt", "")
-            opts = q.get("options", [])
-
-            # ====== 题目区：显示完整内容 ======
-            st.markdown("---")
-            st.markdown(f"### 题目 {i+1}")
-
-            # 题干
-            if prompt:
-                st.write(prompt)
-
-            # 选项完整文本放在题目中展示（避免下拉框截断）
-            opt_map = {o.get("key"): o.get("text", "") for o in opts}
-            a_text = opt_map.get("A", "")
-            b_text = opt_map.get("B", "")
-            c_text = opt_map.get("C", "")  # 通常是“差不多”
-
-            # 用 markdown + st.write 展示长文本（自动换行）
-            st.markdown("**选项 A：**")
-            st.write(a_text if a_text else "（空）")
-
-            st.markdown("**选项 B：**")
-            st.write(b_text if b_text else "（空）")
-
-            st.markdown("**选项 C：**")
-            st.write(c_text if c_text else "（空）")
+            q_qid = qid_keys[i]
+            # ====== 题目区：显示完整内容（markdown 已在领取时预先拼好） ======
+            st.markdown(question_md[i])
 
             # ====== 下拉框：只显示 A/B/C（+ 未选择） ======
-            choices = ["（未选择）", "A", "B", "C"]
-            cur = answers.get(q_qid)  # "A"/"B"/"C" or None
-            index = choices.index(cur) if cur in ["A", "B", "C"] else 0
+            index = int(answer_arr[i]) + 1  # -1(未作答) -> 0
 
             sel = st.selectbox(
                 "请选择：",
-                options=choices,
+                options=ANSWER_CHOICES,
                 index=index,
                 key=f"sel_{q_qid}",
             )
 
-            if sel == "（未选择）":
-                answers.pop(q_qid, None)
-            else:
-                answers[q_qid] = sel
+            answer_arr[i] = CHOICE_CODE[sel]
 
         st.markdown("---")
-        answered_after = sum(1 for q in questions if q.get("qid") in answers)
+        answered_after = int((answer_arr >= 0).sum())
         st.write(f"底部进度：已完成 {answered_after}/{total} 题")
         st.progress(answered_after / total if total else 0.0)
 
@@ -282,19 +261,16 @@ elif stage == "doing":
         st.rerun()
 
     if submit_clicked:
-        missing_idx = []
-        for i, q in enumerate(questions):
-            q_qid = q.get("qid")
-            if q_qid not in answers:
-                missing_idx.append(i)
-
-        if missing_idx:
-            missing_numbers = [i + 1 for i in missing_idx]
-            st.session_state["missing_numbers"] = missing_numbers
-            st.session_state["missing_first_page"] = missing_idx[0] // per
+        missing_idx = np.flatnonzero(answer_arr < 0)
+
+        if missing_idx.size:
+            st.session_state["missing_numbers"] = (missing_idx + 1).tolist()
+            st.session_state["missing_first_page"] = int(missing_idx[0]) // per
             st.session_state["show_missing_dialog"] = True
             st.rerun()
         else:
+            qid_index: Dict[str, int] = st.session_state.get("qid_index", {})
+            answers = {q_qid: "ABC"[answer_arr[i]] for q_qid, i in qid_index.items() if answer_arr[i] >= 0}
             ok_submit = db.submit(qid=qid, sid=sid, answers=answers)
             if not ok_submit:
                 st.error("提交失败：可能问卷已超时或不再属于你。请重新领取。")
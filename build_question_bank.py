@@ -4,14 +4,36 @@
 from __future__ import annotations
 
 import argparse
+import functools
 import hashlib
 import json
+import mmap
+import operator
 import os
 import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Any, Dict, Iterable, List, Optional, Tuple
 
+try:
+    import orjson
+
+    _loads = orjson.loads
+
+    def _dumps(obj: Any, indent: bool = False) -> bytes:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, option=option)
+except ImportError:  # 未安装 orjson 时退回标准库（json.loads 同样接受 bytes）
+    _loads = json.loads
+
+    def _dumps(obj: Any, indent: bool = False) -> bytes:
+        # 与 orjson 相同的分隔符：装不装 orjson 输出的字节一致
+        if indent:
+            return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
 
 # -------------------------
 # Labels (name + explanation)
@@ -38,43 +60,70 @@ MORAL_LABELS = [
     ("Sanctity", "wanting to live in a way that is clean, pure, and holy"),
 ]
 
+# 预先构造好 {name, desc}，pick_target_labels 直接复用（只读共享，不要原地修改）
+_VALUE_D = tuple({"name": n, "desc": d} for n, d in VALUE_LABELS)
+_MORAL_D = tuple({"name": n, "desc": d} for n, d in MORAL_LABELS)
+
 
 # -------------------------
 # IO helpers
 # -------------------------
+# 大块写缓冲（默认 8KB 太小，大题库会产生大量小 write 系统调用）
+_WRITE_BUFFER_SIZE = 1 << 20
+# 超过该大小的 JSONL 输入改用 mmap 逐行解析
+_MMAP_THRESHOLD = 100 << 20
+
+
 def load_json_or_jsonl(path: Path) -> List[Dict[str, Any]]:
     """
     Load JSON list OR JSONL lines.
     Returns list[dict].
     """
-    text = path.read_text(encoding="utf-8").strip()
-    if not text:
+    # 按字节读取 + 按 b"\n" 切行，直接交给 _loads，省掉整文件 UTF-8 解码和 strip/splitlines 的拷贝
+    size = path.stat().st_size
+    if size == 0:
         return []
-    if text[0] == "[":
-        data = json.loads(text)
-        if not isinstance(data, list):
-            raise ValueError(f"{path} is JSON but not a list.")
-        return [x for x in data if isinstance(x, dict)]
-    # JSONL
+    with path.open("rb") as f:
+        head = f.read(4096).lstrip()
+        while not head and f.tell() < size:
+            head = f.read(4096).lstrip()
+        if not head:
+            return []
+        if head[:1] == b"[":
+            data = _loads(path.read_bytes())
+            if not isinstance(data, list):
+                raise ValueError(f"{path} is JSON but not a list.")
+            return [x for x in data if isinstance(x, dict)]
+        # JSONL：大文件用 mmap 逐行读，不把整份文件读进内存
+        if size > _MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return _parse_jsonl_lines(iter(mm.readline, b""))
+    return _parse_jsonl_lines(path.read_bytes().split(b"\n"))
+
+
+def _parse_jsonl_lines(lines: Iterable[bytes]) -> List[Dict[str, Any]]:
     rows = []
-    for line in text.splitlines():
+    for line in lines:
         line = line.strip()
         if not line:
             continue
-        rows.append(json.loads(line))
-    return [x for x in rows if isinstance(x, dict)]
+        x = _loads(line)
+        if isinstance(x, dict):
+            rows.append(x)
+    return rows
 
 
 def write_jsonl(path: Path, items: Iterable[Dict[str, Any]]) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("w", encoding="utf-8") as f:
+    with path.open("wb", buffering=_WRITE_BUFFER_SIZE) as f:
         for obj in items:
-            f.write(json.dumps(obj, ensure_ascii=False) + "\n")
+            f.write(_dumps(obj))
+            f.write(b"\n")
 
 
 def write_json(path: Path, items: List[Dict[str, Any]]) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
-    path.write_text(json.dumps(items, ensure_ascii=False, indent=2), encoding="utf-8")
+    path.write_bytes(_dumps(items, indent=True))
 
 
 def sha1(s: str) -> str:
@@ -84,6 +133,15 @@ def sha1(s: str) -> str:
 # -------------------------
 # Optional OpenAI translator
 # -------------------------
+# A very direct translation prompt; you can refine later.
+# 固定前缀只构建一次，每次请求只拼接待翻译文本
+_TRANSLATE_PROMPT_PREFIX = (
+    "请将下面文本翻译成中文，保持原意，尽量自然流畅；"
+    "保留专有名词；不要添加额外解释。\n\n"
+    "文本：\n"
+)
+
+
 class OptionalTranslator:
     """
     Optional Chinese translation using OpenAI Responses API.
@@ -92,6 +150,10 @@ class OptionalTranslator:
       - translate_enabled=True
       - openai package available
       - OPENAI_API_KEY set (recommended by OpenAI docs)
+
+    The cache is an append-only JSONL log next to cache_path (same stem, .jsonl suffix):
+    one {"k": sha1, "v": translation} line per new translation, last write wins on load.
+    A legacy whole-dict JSON file at cache_path is still read once as a seed.
     """
     def __init__(self, translate_enabled: bool, model: str, cache_path: Optional[Path]):
         self.enabled = translate_enabled
@@ -99,14 +161,20 @@ class OptionalTranslator:
         self.cache_path = cache_path
         self.cache: Dict[str, str] = {}
         self._client = None
+        self._log_path: Optional[Path] = None
+        self._log_fp = None
+        self._lock = threading.Lock()
 
         if self.cache_path:
             self.cache_path.parent.mkdir(parents=True, exist_ok=True)
-            if self.cache_path.exists():
+            self._log_path = self.cache_path.with_suffix(".jsonl")
+            if self.cache_path != self._log_path and self.cache_path.exists():
                 try:
-                    self.cache = json.loads(self.cache_path.read_text(encoding="utf-8"))
+                    self.cache = _loads(self.cache_path.read_bytes())
                 except Exception:
                     self.cache = {}
+            if self._log_path.exists() and self._log_path.stat().st_size > 0:
+                self._replay_log(self._log_path)
 
         if self.enabled:
             try:
@@ -121,25 +189,66 @@ class OptionalTranslator:
                     "Please: pip install openai"
                 ) from e
 
-    def _save_cache(self) -> None:
-        if not self.cache_path:
+    def _replay_log(self, path: Path) -> None:
+        # mmap 后逐行读取：冷启动时不把整个日志读成一个大 bytes 再切分
+        cache = self.cache
+        with path.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for line in iter(mm.readline, b""):
+                try:
+                    rec = _loads(line)
+                    cache[rec["k"]] = rec["v"]
+                except Exception:
+                    continue  # 中途崩溃可能留下半行，跳过即可
+
+    def _append_cache(self, key: str, value: str) -> None:
+        if not self._log_path:
             return
-        self.cache_path.write_text(json.dumps(self.cache, ensure_ascii=False, indent=2), encoding="utf-8")
+        if self._log_fp is None:
+            self._log_fp = self._log_path.open("ab", buffering=64 * 1024)
+        self._log_fp.write(_dumps({"k": key, "v": value}))
+        self._log_fp.write(b"\n")
+
+    def close(self) -> None:
+        if self._log_fp is not None:
+            self._log_fp.close()
+            self._log_fp = None
+
+    def translate_zh_batch(self, texts: List[str], max_workers: int = 16) -> List[str]:
+        """
+        Translate many texts at once; returns translations in input order.
+        Cached and duplicate texts are filtered first, the rest goes through one `ex.map`
+        pass so up to `max_workers` requests stay in flight until the queue drains, and
+        the cache log is flushed once at the end.
+        """
+        if not self.enabled:
+            return list(texts)
+        todo: Dict[str, str] = {}
+        for t in texts:
+            t = t or ""
+            key = sha1(t)
+            if key not in self.cache and key not in todo:
+                todo[key] = t
+
+        pending = list(todo.values())
+        if pending:
+            with ThreadPoolExecutor(max_workers=max(1, max_workers)) as ex:
+                for _ in ex.map(self.translate_zh, pending):
+                    pass
+            with self._lock:
+                if self._log_fp is not None:
+                    self._log_fp.flush()
+        return [self.cache[sha1(t or "")] for t in texts]
 
     def translate_zh(self, text: str) -> str:
         if not self.enabled:
             return text
         text = text or ""
         key = sha1(text)
-        if key in self.cache:
-            return self.cache[key]
+        with self._lock:
+            if key in self.cache:
+                return self.cache[key]
 
-        # A very direct translation prompt; you can refine later.
-        prompt = (
-            "请将下面文本翻译成中文，保持原意，尽量自然流畅；"
-            "保留专有名词；不要添加额外解释。\n\n"
-            f"文本：\n{text}"
-        )
+        prompt = _TRANSLATE_PROMPT_PREFIX + text
 
         # Official SDK: Responses API
         resp = self._client.chat.completions.create(
@@ -154,8 +263,9 @@ class OptionalTranslator:
         out = resp
         out = out.strip()
 
-        self.cache[key] = out
-        self._save_cache()
+        with self._lock:
+            self.cache[key] = out
+            self._append_cache(key, out)
         return out
 
 
@@ -166,44 +276,53 @@ def pick_target_labels(task: str, value_ids: List[Any]) -> List[Dict[str, str]]:
     """
     Convert value_ids multi-hot vector -> list of {name, desc} where value==1.
     """
-    task = task.lower()
-    labels = VALUE_LABELS if task == "value" else MORAL_LABELS
+    labels = _VALUE_D if task.lower() == "value" else _MORAL_D
+    n = len(labels)
 
     picked = []
-    for i, v in enumerate(value_ids or []):
-        try:
-            fv = float(v)
-        except Exception:
-            fv = 0.0
-        if fv >= 0.5:
-            if i < len(labels):
-                name, desc = labels[i]
-            else:
-                name, desc = f"Dim{i+1}", ""
-            picked.append({"name": name, "desc": desc})
+    append = picked.append
+    for i, v in enumerate(value_ids or ()):
+        if not isinstance(v, (int, float)):
+            try:
+                v = float(v)
+            except Exception:
+                continue
+        if v >= 0.5:
+            append(labels[i] if i < n else {"name": f"Dim{i+1}", "desc": ""})
     return picked
 
 
-def build_prompt_value(targets: List[Dict[str, str]]) -> str:
-    # 按你要求：题目里要带解释，便于填写者理解
-    if not targets:
-        target_block = "（无）"
-    else:
-        # 每个目标一行：Name (desc)
-        target_block = "\n".join([f"- {t['name']} ({t['desc']})" for t in targets])
+def _targets_key(targets: List[Dict[str, str]]) -> Tuple[Tuple[str, str], ...]:
+    # 保持顺序的 (name, desc) 元组，作为下面 lru_cache 的 key
+    return tuple((t["name"], t["desc"]) for t in targets)
+
+
+@functools.lru_cache(maxsize=1024)
+def _render_target_block(key: Tuple[Tuple[str, str], ...]) -> str:
+    # 同一题库里目标组合重复率很高：每种组合只拼一次
+    if not key:
+        return "（无）"
+    # 每个目标一行：Name (desc)
+    return "\n".join([f"- {name} ({desc})" for name, desc in key])
+
 
+@functools.lru_cache(maxsize=1024)
+def _render_prompt_value(key: Tuple[Tuple[str, str], ...]) -> str:
+    # value 题干只依赖目标组合，整段缓存
     return (
         "以下选项中，哪个更符合目标价值观？\n\n"
         "目标价值观：\n"
-        f"{target_block}\n"
+        f"{_render_target_block(key)}\n"
     )
 
 
+def build_prompt_value(targets: List[Dict[str, str]]) -> str:
+    # 按你要求：题目里要带解释，便于填写者理解
+    return _render_prompt_value(_targets_key(targets))
+
+
 def build_prompt_mic(targets: List[Dict[str, str]], input_text: str) -> str:
-    if not targets:
-        target_block = "（无）"
-    else:
-        target_block = "\n".join([f"- {t['name']} ({t['desc']})" for t in targets])
+    target_block = _render_target_block(_targets_key(targets))
 
     return (
         "以下回答中，哪个更符合目标道德观？\n\n"
@@ -214,13 +333,17 @@ def build_prompt_mic(targets: List[Dict[str, str]], input_text: str) -> str:
     )
 
 
+# 按你要求：I would say, \"I + response
+_PREFIX = 'I would say, "I '
+# 选项 C 固定不变：所有题共享同一个 dict（只读，不要原地修改）
+_OPT_C = {"key": "C", "text": "差不多"}
+
+
 def build_options_value(resp_a: str, resp_b: str) -> List[Dict[str, str]]:
-    # 按你要求：I would say, \"I + response
-    prefix = 'I would say, "I '
     return [
-        {"key": "A", "text": prefix + (resp_a or "")},
-        {"key": "B", "text": prefix + (resp_b or "")},
-        {"key": "C", "text": "差不多"},
+        {"key": "A", "text": _PREFIX + (resp_a or "")},
+        {"key": "B", "text": _PREFIX + (resp_b or "")},
+        _OPT_C,
     ]
 
 
@@ -228,7 +351,7 @@ def build_options_mic(resp_a: str, resp_b: str) -> List[Dict[str, str]]:
     return [
         {"key": "A", "text": resp_a or ""},
         {"key": "B", "text": resp_b or ""},
-        {"key": "C", "text": "差不多"},
+        _OPT_C,
     ]
 
 
@@ -245,20 +368,25 @@ def align_records(
     Returns list of (row_index, rec_a, rec_b)
     """
     if len(rows_a) == len(rows_b) and len(rows_a) > 0:
-        # quick check
+        # quick check：前 200 行按 16 行一块，用 map(operator.eq) 在 C 层逐对比较；
+        # 已达到 90% 阈值，或剩余行全部匹配也达不到阈值时，立即停止
+        n = min(len(rows_a), 200)  # sample check
+        need = int(0.9 * n)
         match = 0
-        for i in range(min(len(rows_a), 200)):  # sample check
-            if (rows_a[i].get(key_field) == rows_b[i].get(key_field)):
-                match += 1
-        if match >= int(0.9 * min(len(rows_a), 200)):
+        for start in range(0, n, 16):
+            end = min(n, start + 16)
+            if match >= need or match + (n - start) < need:
+                break
+            keys_a = [r.get(key_field) for r in rows_a[start:end]]
+            keys_b = [r.get(key_field) for r in rows_b[start:end]]
+            match += sum(map(operator.eq, keys_a, keys_b))
+        if match >= need:
             return [(i, rows_a[i], rows_b[i]) for i in range(len(rows_a))]
 
     # fallback: align by input string
-    map_a: Dict[str, Dict[str, Any]] = {}
-    for r in rows_a:
-        k = str(r.get(key_field, ""))
-        if k and k not in map_a:
-            map_a[k] = r
+    # 倒序构建 dict：同一 key 后写覆盖先写，等价于“保留第一次出现的记录”；空 key 不参与对齐
+    map_a: Dict[str, Dict[str, Any]] = {str(r.get(key_field, "")): r for r in reversed(rows_a)}
+    map_a.pop("", None)
 
     aligned: List[Tuple[int, Dict[str, Any], Dict[str, Any]]] = []
     for j, r in enumerate(rows_b):
@@ -282,6 +410,7 @@ class BuildArgs:
     translate_zh: bool
     openai_model: str
     translate_cache: Optional[Path]
+    translate_workers: int = 16
 
 
 def build_question_bank(args: BuildArgs) -> List[Dict[str, Any]]:
@@ -308,7 +437,8 @@ def build_question_bank(args: BuildArgs) -> List[Dict[str, Any]]:
         cache_path=args.translate_cache,
     )
 
-    bank: List[Dict[str, Any]] = []
+    # Pass 1: build prompt/options for every picked record (pure CPU, no network)
+    drafts = []
     for idx, rec_a, rec_b in picked:
         input_text = str(rec_a.get("input", ""))
         # value_ids 用 A 文件为准（一般应一致）
@@ -323,41 +453,62 @@ def build_question_bank(args: BuildArgs) -> List[Dict[str, Any]]:
             options = build_options_mic(str(rec_a.get("response", "")), str(rec_b.get("response", "")))
         else:
             raise ValueError(f"Unknown task: {args.task}")
+        drafts.append((idx, rec_a, rec_b, input_text, value_ids, targets, prompt, options))
+
+    # qid = sha1("A|B|idx|input")[:16]：公共前缀只哈希一次，每题 copy 后只追加变化的部分
+    qid_base = hashlib.sha1(f"{args.method_a_name}|{args.method_b_name}|".encode("utf-8"))
 
+    bank: List[Dict[str, Any]] = []
+    try:
         # Optional translation: translate the whole prompt and option texts
         # （你后续也可以改成只翻译 input/response，而不翻译“价值观解释”等固定文本）
-        prompt_zh = translator.translate_zh(prompt) if args.translate_zh else prompt
-        options_zh = []
-        for opt in options:
-            t = opt["text"]
-            t_zh = translator.translate_zh(t) if args.translate_zh and opt["key"] != "C" else t
-            options_zh.append({"key": opt["key"], "text": t_zh})
-
-        qid = f"{task}-{sha1(args.method_a_name + '|' + args.method_b_name + '|' + str(idx) + '|' + input_text)[:16]}"
-
-        bank.append({
-            "qid": qid,
-            "task": task,
-            "method_a": args.method_a_name,
-            "method_b": args.method_b_name,
-            "source": {
-                "path_a": str(args.path_a),
-                "path_b": str(args.path_b),
-                "row_index": idx,
-            },
-            "target_labels": targets,  # name + desc
-            "prompt": prompt_zh,
-            "options": options_zh,      # A/B/C with text
-            # 留原始内容，方便之后回溯/复核（不会在学生端展示）
-            "raw": {
-                "input": input_text,
-                "response_a": str(rec_a.get("response", "")),
-                "response_b": str(rec_b.get("response", "")),
-                "value_ids": value_ids,
-                "pred_value_ids_a": rec_a.get("pred_value_ids", None),
-                "pred_value_ids_b": rec_b.get("pred_value_ids", None),
-            }
-        })
+        # 先收集全部待翻译文本，一次性批量翻译，再逐题从结果里取
+        zh: Dict[str, str] = {}
+        if args.translate_zh:
+            texts = []
+            for d in drafts:
+                texts.append(d[6])
+                texts.extend(opt["text"] for opt in d[7] if opt["key"] != "C")
+            zh = dict(zip(texts, translator.translate_zh_batch(texts, max_workers=args.translate_workers)))
+
+        # Pass 2: assemble bank items
+        for idx, rec_a, rec_b, input_text, value_ids, targets, prompt, options in drafts:
+            prompt_zh = zh.get(prompt, prompt)
+            options_zh = []
+            for opt in options:
+                t = opt["text"]
+                t_zh = zh.get(t, t) if opt["key"] != "C" else t
+                options_zh.append({"key": opt["key"], "text": t_zh})
+
+            h = qid_base.copy()
+            h.update(f"{idx}|{input_text}".encode("utf-8"))
+            qid = f"{task}-{h.hexdigest()[:16]}"
+
+            bank.append({
+                "qid": qid,
+                "task": task,
+                "method_a": args.method_a_name,
+                "method_b": args.method_b_name,
+                "source": {
+                    "path_a": str(args.path_a),
+                    "path_b": str(args.path_b),
+                    "row_index": idx,
+                },
+                "target_labels": targets,  # name + desc
+                "prompt": prompt_zh,
+                "options": options_zh,      # A/B/C with text
+                # 留原始内容，方便之后回溯/复核（不会在学生端展示）
+                "raw": {
+                    "input": input_text,
+                    "response_a": str(rec_a.get("response", "")),
+                    "response_b": str(rec_b.get("response", "")),
+                    "value_ids": value_ids,
+                    "pred_value_ids_a": rec_a.get("pred_value_ids", None),
+                    "pred_value_ids_b": rec_b.get("pred_value_ids", None),
+                }
+            })
+    finally:
+        translator.close()
 
     return bank
 
@@ -378,6 +529,7 @@ def main():
     p.add_argument("--translate-zh", action="store_true", help="If set, translate prompt/options into Chinese via OpenAI.")
     p.add_argument("--openai-model", default="gpt-4o-mini", type=str, help="OpenAI model for translation (Responses API).")
     p.add_argument("--translate-cache", default="", type=str, help="Path to translation cache json (optional).")
+    p.add_argument("--translate-workers", default=16, type=int, help="Max concurrent translation requests.")
 
     args_ns = p.parse_args()
     args = BuildArgs(
@@ -393,6 +545,7 @@ def main():
         translate_zh=bool(args_ns.translate_zh),
         openai_model=args_ns.openai_model,
         translate_cache=Path(args_ns.translate_cache) if args_ns.translate_cache else None,
+        translate_workers=int(args_ns.translate_workers),
     )
 
     bank = build_question_bank(args)
@@ -4,14 +4,51 @@
 from __future__ import annotations
 
 import argparse
+import functools
 import json
 import os
+from collections import defaultdict
+from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, List, Tuple, Optional
+from typing import Any, Dict, Iterator, List, Tuple, Optional
 
 import pymysql
 
+try:
+    import orjson
+
+    _loads = orjson.loads
+
+    def _dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+except ImportError:  # 未安装 orjson 时退回标准库（json.loads 同样接受 bytes）
+    _loads = json.loads
+
+    def _dumps(obj: Any) -> bytes:
+        # 与 orjson 相同的紧凑分隔符：装不装 orjson 输出的字节一致
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+# 大块写缓冲（默认 8KB 太小，整库导出会产生大量小 write 系统调用）
+_WRITE_BUFFER_SIZE = 1 << 20
+# 不超过该题数的 bank 整体拼接后单次写出，超过则走上面的大缓冲逐行写
+_SMALL_WRITE_ITEMS = 4096
+
+
+# 查询结果在读取时一次性转成定型记录，只保留合并循环真正读取的字段；
+# sid 是 VARCHAR NOT NULL，pymysql 已返回 str，后续不再逐字段 str()
+@dataclass
+class QuestionnaireRec:
+    questions: Any  # JSON_EXTRACT(payload, '$.questions') 原始文本，可能为 None
+
+
+@dataclass
+class SubmissionRec:
+    sid: str
+    submitted_at: str
+    answers: Any  # answers JSON 原始文本
+
 
 def connect_tidb(host: str, port: int, user: str, password: str, database: str, ca_path: str | None):
     ssl = None
@@ -25,7 +62,7 @@ def connect_tidb(host: str, port: int, user: str, password: str, database: str,
         database=database,
         charset="utf8mb4",
         cursorclass=pymysql.cursors.DictCursor,
-        autocommit=False,
+        autocommit=True,  # 不开隐式事务；main 里显式开一个只读事务，整个导出读同一快照
         ssl=ssl,
         connect_timeout=10,
         read_timeout=120,
@@ -33,21 +70,22 @@ def connect_tidb(host: str, port: int, user: str, password: str, database: str,
     )
 
 
-def parse_json(v) -> Dict[str, Any]:
+def parse_json(v) -> Any:
     if isinstance(v, dict):
         return v
-    if isinstance(v, (bytes, bytearray)):
-        v = v.decode("utf-8", errors="ignore")
-    if isinstance(v, str):
-        return json.loads(v)
-    return json.loads(str(v))
+    if isinstance(v, (bytes, bytearray, str)):
+        return _loads(v)  # orjson 直接解析 str/bytes，无需先 decode
+    return _loads(str(v))
 
 
+# 同一批提交的时间戳大量重复：按原始值缓存格式化结果
+@functools.lru_cache(maxsize=4096)
 def dt_to_str(x) -> str:
     if x is None:
         return ""
     if isinstance(x, datetime):
-        return x.isoformat(sep=" ", timespec="seconds")
+        # 等价于 isoformat(sep=" ", timespec="seconds")（pymysql 返回的是 naive datetime）
+        return f"{x.year:04d}-{x.month:02d}-{x.day:02d} {x.hour:02d}:{x.minute:02d}:{x.second:02d}"
     return str(x)
 
 
@@ -66,35 +104,78 @@ def safe_get_row_index(item: dict) -> int:
 def atomic_write_jsonl(path: Path, records: List[dict]) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
     tmp = path.with_suffix(path.suffix + f".tmp_{int(datetime.now().timestamp() * 1000)}")
-    with tmp.open("w", encoding="utf-8") as f:
-        for r in records:
-            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+    if len(records) <= _SMALL_WRITE_ITEMS:
+        # 小 bank：拼成一个 buffer 一次写出
+        parts = [_dumps(r) for r in records]
+        parts.append(b"")
+        tmp.write_bytes(b"\n".join(parts))
+    else:
+        with tmp.open("wb", buffering=_WRITE_BUFFER_SIZE) as f:
+            for r in records:
+                f.write(_dumps(r))
+                f.write(b"\n")
     tmp.replace(path)
 
 
-def fetch_all_questionnaires(conn, only_done: bool) -> List[dict]:
+def _stream_rows(cur, sql: str, params: Tuple = (), batch: int = 1024) -> Iterator[dict]:
+    """
+    在复用的 SSDictCursor（服务端游标）上执行查询，fetchmany 分批流式读取，不在 Python 侧一次性物化整个结果集。
+    注意：必须把生成器消费完，才能在同一游标/连接上执行下一条查询。
+    """
+    cur.execute(sql, params)
+    while True:
+        rows = cur.fetchmany(batch)
+        if not rows:
+            break
+        yield from rows
+
+
+def list_banks(cur, only_done: bool, bank: str = "") -> List[str]:
+    sql = "SELECT DISTINCT bank FROM questionnaires WHERE 1=1"
+    params: List[Any] = []
+    if only_done:
+        sql += " AND status='done'"
+    if bank:
+        sql += " AND bank=%s"
+        params.append(bank)
+    sql += " ORDER BY bank;"
+    cur.execute(sql, params)
+    return [r["bank"] for r in cur.fetchall()]
+
+
+def count_submissions(cur) -> int:
+    cur.execute("SELECT COUNT(*) AS n FROM submissions;")
+    return int(cur.fetchone()["n"])
+
+
+def fetch_bank_questionnaires(cur, bank: str, only_done: bool) -> Iterator[QuestionnaireRec]:
+    # 只需要 payload.questions：让 TiDB 端抽取，少传 meta 等其余字段，也少在 Python 侧解析
     sql = """
-    SELECT qid, bank, rel_path, payload, status
+    SELECT JSON_EXTRACT(payload, '$.questions') AS questions
     FROM questionnaires
+    WHERE bank=%s
     """
     if only_done:
-        sql += " WHERE status='done' "
-    sql += " ORDER BY bank, rel_path;"
-    with conn.cursor() as cur:
-        cur.execute(sql)
-        return cur.fetchall()
+        sql += " AND status='done' "
+    sql += " ORDER BY rel_path;"
+    for r in _stream_rows(cur, sql, (bank,)):
+        yield QuestionnaireRec(r["questions"])
 
 
-def fetch_all_submissions(conn) -> List[dict]:
-    # submissions.qid 是“问卷ID（questionnaire id）”，不是题目 qid
+def fetch_bank_submissions(cur, bank: str, only_done: bool) -> Iterator[SubmissionRec]:
+    # submissions.qid 是“问卷ID（questionnaire id）”，不是题目 qid；
+    # JOIN questionnaires 只取本 bank（且满足 only_done）的问卷的提交
     sql = """
-    SELECT qid AS questionnaire_id, sid, submitted_at, answers
-    FROM submissions
-    ORDER BY submitted_at ASC, id ASC;
+    SELECT s.sid, s.submitted_at, s.answers
+    FROM submissions s
+    JOIN questionnaires q ON q.qid = s.qid
+    WHERE q.bank=%s
     """
-    with conn.cursor() as cur:
-        cur.execute(sql)
-        return cur.fetchall()
+    if only_done:
+        sql += " AND q.status='done' "
+    sql += " ORDER BY s.submitted_at ASC, s.id ASC;"
+    for r in _stream_rows(cur, sql, (bank,)):
+        yield SubmissionRec(r["sid"], dt_to_str(r["submitted_at"]), r["answers"])
 
 
 def main():
@@ -126,93 +207,68 @@ def main():
         ca_path = str(Path(ca_path).resolve())
 
     conn = connect_tidb(args.host, args.port, args.user, password, args.database, ca_path)
+    # 整个导出复用同一个服务端游标（每个 bank 两条查询，不再反复创建/销毁游标）
+    cur = conn.cursor(pymysql.cursors.SSDictCursor)
     try:
-        # 1) 读取问卷（用于拿到“题目原始 item 结构”）
-        q_rows = fetch_all_questionnaires(conn, only_done=args.only_done)
-        print(f"[load] questionnaires rows: {len(q_rows)} (only_done={args.only_done})")
-
-        # bank -> {question_qid -> canonical_item_dict_with_choice_list}
-        bank_items: Dict[str, Dict[str, dict]] = {}
-        # questionnaire_id -> bank（用于把 submissions 分配回对应 bank）
-        questionnaire_to_bank: Dict[str, str] = {}
-
-        for qr in q_rows:
-            questionnaire_id = str(qr["qid"])  # 这是问卷ID（rel_path）
-            bank = str(qr.get("bank", ""))
-            if args.bank and bank != args.bank:
-                continue
-            questionnaire_to_bank[questionnaire_id] = bank
-
-            payload = parse_json(qr["payload"])
-            questions = payload.get("questions", []) or []
-
-            if bank not in bank_items:
-                bank_items[bank] = {}
-
-            for item in questions:
-                # item 就是 Step1 的题库 item 风格（qid/task/method_a/.../raw/options...）
-                question_qid = item.get("qid", None)
-                if question_qid is None:
-                    continue
-                question_qid = str(question_qid)
-
-                if question_qid not in bank_items[bank]:
-                    canonical = dict(item)
-                    canonical["choice"] = []  # ✅ 追加汇总字段
-                    bank_items[bank][question_qid] = canonical
-                else:
-                    # 已存在：不覆盖 canonical，避免不同问卷中字段轻微差异导致抖动
-                    pass
-
-        if not bank_items:
+        # 逐 bank 的多条查询和最后的 count_submissions 必须看到同一快照，
+        # 否则导出期间新写入的提交会被算成 missed
+        cur.execute("START TRANSACTION READ ONLY, WITH CONSISTENT SNAPSHOT;")
+        # 逐个 bank 处理：读问卷 -> 读该 bank 的提交 -> 写出 -> 释放，内存峰值只有一个 bank
+        banks = list_banks(cur, only_done=args.only_done, bank=args.bank)
+        if not banks:
             raise RuntimeError("No bank items built from questionnaires payload. Check --only_done/--bank filters.")
 
-        # 2) 读取所有 submissions，把答案汇总到对应题目 item 的 choice 列表里
-        subs = fetch_all_submissions(conn)
-        print(f"[load] submissions rows: {len(subs)}")
-
-        missed_questionnaires = 0
+        q_count = 0
+        sub_count = 0
         appended = 0
-
-        for s in subs:
-            questionnaire_id = str(s["questionnaire_id"])
-            bank = questionnaire_to_bank.get(questionnaire_id, None)
-            if bank is None:
-                # submissions 里有，但 questionnaires 里找不到（例如你用了 --only_done 导致过滤掉了）
-                missed_questionnaires += 1
-                continue
-            if args.bank and bank != args.bank:
-                continue
-
-            sid = str(s.get("sid", ""))
-            submitted_at = dt_to_str(s.get("submitted_at"))
-            answers = parse_json(s.get("answers"))
-
-            # answers: {question_qid: "A"/"B"/"C"}
-            for qid_str, choice in answers.items():
-                qid_str = str(qid_str)
-                if qid_str not in bank_items.get(bank, {}):
-                    # 理论上不会发生：除非 payload/questions 不全或题目缺失
-                    continue
-                bank_items[bank][qid_str]["choice"].append(
-                    {
-                        "sid": sid,
-                        "submitted_at": submitted_at,
-                        "choice": str(choice),
-                    }
-                )
-                appended += 1
-
-        print(f"[merge] appended choice records: {appended}")
-        if missed_questionnaires:
-            print(
-                f"[warn] submissions referring to questionnaires not present in built index: {missed_questionnaires} "
-                f"(可能是你加了 --only_done 或只导出了部分问卷 payload)"
-            )
-
-        # 3) 按 bank 输出 Step1 风格的题库 jsonl（每行一题，含 choice 列表）
         total_items = 0
-        for bank, items_map in bank_items.items():
+        for bank in banks:
+            # 1) 读取本 bank 问卷（用于拿到“题目原始 item 结构”）
+            # question_qid -> canonical_item_dict（choice 列表在写出时再挂上）
+            items_map: Dict[str, dict] = {}
+            for qr in fetch_bank_questionnaires(cur, bank, only_done=args.only_done):
+                q_count += 1
+                # payload 中没有 questions 时 JSON_EXTRACT 返回 NULL
+                questions = (parse_json(qr.questions) if qr.questions is not None else None) or []
+
+                for item in questions:
+                    # item 就是 Step1 的题库 item 风格（qid/task/method_a/.../raw/options...）
+                    question_qid = item.get("qid", None)
+                    if question_qid is None:
+                        continue
+                    question_qid = str(question_qid)
+
+                    if question_qid not in items_map:
+                        # questions 每行单独解析、用完即丢，直接复用 item 本身作为 canonical，不再拷贝
+                        items_map[question_qid] = item
+                    else:
+                        # 已存在：不覆盖 canonical，避免不同问卷中字段轻微差异导致抖动
+                        pass
+                # 释放本问卷其余（未被引用的）题目
+                del questions
+
+            # 2) 读取本 bank 的 submissions，把答案按题目 qid 汇总成 (sid, submitted_at, choice) 元组，
+            #    写出时才转成 dict，避免每条作答都分配一个小 dict
+            choices: Dict[str, List[Tuple[str, str, str]]] = defaultdict(list)
+            for s in fetch_bank_submissions(cur, bank, only_done=args.only_done):
+                sub_count += 1
+                sid = s.sid
+                submitted_at = s.submitted_at
+                answers = parse_json(s.answers)
+
+                # answers: {question_qid: "A"/"B"/"C"}（JSON 对象的 key 必然是 str）
+                for qid_str, choice in answers.items():
+                    if qid_str not in items_map:
+                        # 理论上不会发生：除非 payload/questions 不全或题目缺失
+                        continue
+                    choices[qid_str].append((sid, submitted_at, str(choice)))
+                    appended += 1
+
+            # 3) 输出 Step1 风格的题库 jsonl（每行一题，含 choice 列表）
+            for qid_str, it in items_map.items():
+                it["choice"] = [  # ✅ 追加汇总字段
+                    {"sid": sid, "submitted_at": t, "choice": c} for sid, t, c in choices.get(qid_str, ())
+                ]
             # 输出顺序：优先 source.row_index，其次 qid
             items = list(items_map.values())
             items.sort(key=lambda it: (safe_get_row_index(it), str(it.get("qid", ""))))
@@ -221,12 +277,27 @@ def main():
             atomic_write_jsonl(out_path, items)
             total_items += len(items)
             print(f"[write] {bank}: {len(items)} items -> {out_path}")
+            del items_map, choices, items
+
+        # submissions 里有，但不属于已导出问卷的（例如你用了 --only_done 导致过滤掉了）
+        missed_questionnaires = count_submissions(cur) - sub_count
+
+        print(f"[load] questionnaires rows: {q_count} (only_done={args.only_done})")
+        print(f"[load] submissions rows: {sub_count}")
+        print(f"[merge] appended choice records: {appended}")
+        if missed_questionnaires:
+            print(
+                f"[warn] submissions referring to questionnaires not present in built index: {missed_questionnaires} "
+                f"(可能是你加了 --only_done 或只导出了部分问卷 payload)"
+            )
 
-        print(f"[OK] total banks: {len(bank_items)}")
+        print(f"[OK] total banks: {len(banks)}")
         print(f"[OK] total unique items written: {total_items}")
         print(f"[OK] output_dir: {out_root}")
+        conn.commit()  # 结束只读事务
 
     finally:
+        cur.close()
         conn.close()
 
 
@@ -4,14 +4,50 @@
 from __future__ import annotations
 
 import argparse
+import functools
 import json
 import os
+from dataclasses import dataclass
 from datetime import datetime
+from itertools import groupby
+from operator import itemgetter
 from pathlib import Path
 from typing import Any, Dict, List, Tuple, Optional
 
 import pymysql
 
+try:
+    import orjson
+
+    _loads = orjson.loads
+
+    def _dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+except ImportError:  # 未安装 orjson 时退回标准库（json.loads 同样接受 bytes）
+    _loads = json.loads
+
+    def _dumps(obj: Any) -> bytes:
+        # 与 orjson 相同的紧凑分隔符：装不装 orjson 输出的字节一致
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+# 查询结果在读取时一次性转成定型记录：qid/bank/rel_path/sid 都是 VARCHAR NOT NULL，
+# pymysql 已返回 str，合并时不再逐字段 str()
+@dataclass
+class QuestionnaireRec:
+    qid: str
+    bank: str
+    rel_path: str
+    payload: Any  # payload JSON 原始文本
+    status: str
+
+
+@dataclass
+class SubmissionRec:
+    sid: str
+    submitted_at: str
+    answers: Any  # answers JSON 原始文本
+
 
 def connect_tidb(host: str, port: int, user: str, password: str, database: str, ca_path: str | None):
     ssl = None
@@ -26,7 +62,7 @@ def connect_tidb(host: str, port: int, user: str, password: str, database: str,
         database=database,
         charset="utf8mb4",
         cursorclass=pymysql.cursors.DictCursor,
-        autocommit=False,
+        autocommit=True,  # 导出只读：不开隐式事务，不长时间持有快照
         ssl=ssl,
         connect_timeout=10,
         read_timeout=60,
@@ -37,18 +73,19 @@ def connect_tidb(host: str, port: int, user: str, password: str, database: str,
 def parse_json_field(v) -> Dict[str, Any]:
     if isinstance(v, dict):
         return v
-    if isinstance(v, (bytes, bytearray)):
-        v = v.decode("utf-8", errors="ignore")
-    if isinstance(v, str):
-        return json.loads(v)
-    return json.loads(str(v))
+    if isinstance(v, (bytes, bytearray, str)):
+        return _loads(v)  # orjson 直接解析 str/bytes，无需先 decode
+    return _loads(str(v))
 
 
+# 同一批提交的时间戳大量重复：按原始值缓存格式化结果
+@functools.lru_cache(maxsize=4096)
 def dt_to_str(x) -> str:
     if x is None:
         return ""
     if isinstance(x, datetime):
-        return x.isoformat(sep=" ", timespec="seconds")
+        # 等价于 isoformat(sep=" ", timespec="seconds")（pymysql 返回的是 naive datetime）
+        return f"{x.year:04d}-{x.month:02d}-{x.day:02d} {x.hour:02d}:{x.minute:02d}:{x.second:02d}"
     # pymysql 有时会给 str
     return str(x)
 
@@ -56,44 +93,74 @@ def dt_to_str(x) -> str:
 def atomic_write_jsonl(path: Path, meta: dict, questions: List[Dict[str, Any]]) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
     tmp = path.with_suffix(path.suffix + f".tmp_{int(datetime.now().timestamp() * 1000)}")
-    with tmp.open("w", encoding="utf-8") as f:
-        f.write(json.dumps({"__meta__": meta}, ensure_ascii=False) + "\n")
-        for q in questions:
-            f.write(json.dumps(q, ensure_ascii=False) + "\n")
+    # 整份问卷先拼成一个 buffer，一次 write；fsync 后再 replace，保证替换后的文件内容已落盘
+    dumps = _dumps
+    parts = [dumps({"__meta__": meta})]
+    parts.extend(dumps(q) for q in questions)
+    parts.append(b"")
+    with tmp.open("wb") as f:
+        f.write(b"\n".join(parts))
+        f.flush()
+        os.fsync(f.fileno())
     tmp.replace(path)
 
 
-def fetch_questionnaires(conn, only_done: bool) -> List[dict]:
+def fetch_questionnaires(conn, only_done: bool, limit: int = 0) -> List[QuestionnaireRec]:
     sql = """
-    SELECT qid, bank, rel_path, payload, question_count, status, claimed_by, claimed_at
+    SELECT qid, bank, rel_path, payload, status
     FROM questionnaires
     """
     if only_done:
         sql += " WHERE status='done' "
-    sql += " ORDER BY bank, rel_path;"
+    sql += " ORDER BY bank, rel_path"
+    params: Tuple = ()
+    if limit and limit > 0:
+        # 在 SQL 里截断：不把全部行取回来再切片
+        sql += " LIMIT %s"
+        params = (int(limit),)
+    sql += ";"
 
     with conn.cursor() as cur:
-        cur.execute(sql)
-        rows = cur.fetchall()
-    return rows
+        cur.execute(sql, params)
+        return [QuestionnaireRec(r["qid"], r["bank"], r["rel_path"], r["payload"], r["status"]) for r in cur.fetchall()]
 
 
-def fetch_submissions_for_qid(conn, qid: str) -> List[dict]:
-    sql = """
-    SELECT sid, submitted_at, answers
-    FROM submissions
-    WHERE qid=%s
-    ORDER BY submitted_at ASC, id ASC;
+# 每条 SELECT 的 IN 列表最多放多少个 qid
+_SUBMISSION_QID_CHUNK = 1000
+
+
+def fetch_submissions_grouped(conn, qids: List[str]) -> Dict[str, List[SubmissionRec]]:
     """
-    with conn.cursor() as cur:
-        cur.execute(sql, (qid,))
-        rows = cur.fetchall()
-    return rows
+    只取回 qids 对应问卷的 submissions，按问卷 qid 分组（替代逐问卷查询，N 次往返 -> N/1000 次）。
+    --limit / --only_done 已在 fetch_questionnaires 里生效，这里用 WHERE qid IN (...) 分块查询，
+    不再把整张 submissions 表读进内存。
+    用 SSDictCursor 流式读取；按 qid 排序后 groupby，组内保持 submitted_at, id 升序。
+    """
+    grouped: Dict[str, List[SubmissionRec]] = {}
+    with conn.cursor(pymysql.cursors.SSDictCursor) as cur:
+        for i in range(0, len(qids), _SUBMISSION_QID_CHUNK):
+            chunk = qids[i:i + _SUBMISSION_QID_CHUNK]
+            placeholders = ",".join(["%s"] * len(chunk))
+            cur.execute(
+                f"""
+                SELECT qid, sid, submitted_at, answers
+                FROM submissions
+                WHERE qid IN ({placeholders})
+                ORDER BY qid, submitted_at ASC, id ASC;
+                """,
+                chunk,
+            )
+            for qid, rows in groupby(cur, key=itemgetter("qid")):
+                # 用 setdefault 合并：即使排序规则导致同一 qid 不连续也不会丢数据
+                grouped.setdefault(qid, []).extend(
+                    SubmissionRec(r["sid"], dt_to_str(r["submitted_at"]), r["answers"]) for r in rows
+                )
+    return grouped
 
 
 def merge_one_questionnaire(
-    q_row: dict,
-    submissions: List[dict],
+    q_row: QuestionnaireRec,
+    submissions: List[SubmissionRec],
 ) -> Tuple[dict, List[Dict[str, Any]]]:
     """
     输出结构与 Step2 的问卷一致（jsonl + __meta__），但每条题目多一个：
@@ -102,7 +169,7 @@ def merge_one_questionnaire(
         ...
       ]
     """
-    payload = parse_json_field(q_row["payload"])
+    payload = parse_json_field(q_row.payload)
     meta = payload.get("meta", {}) or {}
     questions: List[Dict[str, Any]] = payload.get("questions", []) or []
 
@@ -115,9 +182,9 @@ def merge_one_questionnaire(
 
     # 逐份 submission 合并进每题的 choice list
     for s in submissions:
-        sid = str(s.get("sid", ""))
-        submitted_at = dt_to_str(s.get("submitted_at"))
-        ans_obj = parse_json_field(s.get("answers"))
+        sid = s.sid
+        submitted_at = s.submitted_at
+        ans_obj = parse_json_field(s.answers)
 
         # answers 是 {question_qid: "A"/"B"/"C"} 的 dict
         for qid_str, lst in choice_map.items():
@@ -145,10 +212,10 @@ def merge_one_questionnaire(
     meta_out.update(
         {
             "exported_at": datetime.now().isoformat(sep=" ", timespec="seconds"),
-            "tidb_qid": q_row["qid"],
-            "bank": q_row["bank"],
-            "rel_path": q_row["rel_path"],
-            "status": q_row.get("status"),
+            "tidb_qid": q_row.qid,
+            "bank": q_row.bank,
+            "rel_path": q_row.rel_path,
+            "status": q_row.status,
             "submission_count": len(submissions),
         }
     )
@@ -182,19 +249,17 @@ def main():
 
     conn = connect_tidb(args.host, args.port, args.user, password, args.database, ca_path)
     try:
-        q_rows = fetch_questionnaires(conn, only_done=args.only_done)
-        if args.limit and args.limit > 0:
-            q_rows = q_rows[: args.limit]
+        q_rows = fetch_questionnaires(conn, only_done=args.only_done, limit=args.limit)
 
         total_q = len(q_rows)
         print(f"[scan] questionnaires rows: {total_q}  (only_done={args.only_done})")
+        subs_by_qid = fetch_submissions_grouped(conn, [r.qid for r in q_rows])
         written = 0
         total_sub = 0
 
         for idx, q_row in enumerate(q_rows, start=1):
-            qid = str(q_row["qid"])
-            rel_path = str(q_row["rel_path"])  # 例如 bank_x/questionnaire_001.jsonl
-            sub_rows = fetch_submissions_for_qid(conn, qid)
+            rel_path = q_row.rel_path  # 例如 bank_x/questionnaire_001.jsonl
+            sub_rows = subs_by_qid.get(q_row.qid, [])
             total_sub += len(sub_rows)
 
             meta_out, merged_questions = merge_one_questionnaire(q_row, sub_rows)
@@ -4,41 +4,59 @@
 from __future__ import annotations
 
 import argparse
+import hashlib
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Any, Dict, List, Tuple
 
 import pymysql
 
+try:
+    import orjson
 
-def load_questionnaire_jsonl(path: Path) -> Tuple[dict, List[Dict[str, Any]]]:
+    _loads = orjson.loads
+
+    def _dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+except ImportError:  # 未安装 orjson 时退回标准库（json.loads 同样接受 bytes）
+    _loads = json.loads
+
+    def _dumps(obj: Any) -> bytes:
+        # 与 orjson 相同的紧凑分隔符：装不装 orjson 输出的字节一致
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def load_questionnaire_jsonl(path: Path) -> Tuple[bytes, List[bytes]]:
     """
     读取问卷文件：
     - 如果第 1 行是 {"__meta__": {...}}，则视为 meta 行
     - 否则 meta={}
-    返回 (meta, questions)
-    """
-    lines = path.read_text(encoding="utf-8").splitlines()
-    if not lines:
-        return {}, []
+    返回 (meta_json_bytes, question_line_bytes_list)
 
-    meta: dict = {}
-    start = 0
-    try:
-        obj0 = json.loads(lines[0].strip())
+    题目行保持原始 JSON bytes，不逐行解析再序列化：TiDB 只存 JSON 文本。
+    合法性由 prepare_questionnaire 对拼好的 payload 整体校验一次。只有首行会被解析以识别 meta。
+    """
+    meta = b"{}"
+    questions: List[bytes] = []
+    with path.open("rb") as f:
+        first = f.readline()
+        if not first:
+            return meta, []
+        try:
+            obj0 = _loads(first)
+        except ValueError:
+            obj0 = None
         if isinstance(obj0, dict) and "__meta__" in obj0:
-            meta = obj0.get("__meta__", {}) or {}
-            start = 1
-    except Exception:
-        pass
-
-    questions: List[Dict[str, Any]] = []
-    for ln in lines[start:]:
-        ln = ln.strip()
-        if not ln:
-            continue
-        questions.append(json.loads(ln))
+            meta = _dumps(obj0.get("__meta__", {}) or {})
+        elif first.strip():
+            questions.append(first.strip())
+
+        for ln in f:
+            ln = ln.strip()
+            if ln:
+                questions.append(ln)
     return meta, questions
 
 
@@ -77,6 +95,7 @@ def ensure_schema(conn) -> None:
       bank            VARCHAR(128) NOT NULL,
       rel_path        VARCHAR(512) NOT NULL,
       payload         JSON NOT NULL,
+      payload_sha1    CHAR(40) NOT NULL DEFAULT '',
       question_count  INT NOT NULL,
       status          VARCHAR(16) NOT NULL DEFAULT 'available',
       claimed_by      VARCHAR(32) NULL,
@@ -84,8 +103,9 @@ def ensure_schema(conn) -> None:
       lock_expires_at DATETIME NULL,
       created_at      TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
       updated_at      TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-      KEY idx_status (status),
-      KEY idx_bank   (bank)
+      KEY idx_status_expires (status, lock_expires_at),
+      KEY idx_status_qid     (status, qid),
+      KEY idx_bank           (bank)
     );
     """
 
@@ -105,35 +125,169 @@ def ensure_schema(conn) -> None:
         cur.execute(ddl_questionnaires)
         cur.execute(ddl_submissions)
     conn.commit()
+    ensure_payload_sha1_column(conn)
+    ensure_indexes(conn)
+
+
+def ensure_payload_sha1_column(conn) -> None:
+    """
+    一次性迁移：旧表没有 payload_sha1 列时补上（旧行为空串，下次导入会重写一次并填上哈希）。
+    """
+    with conn.cursor() as cur:
+        cur.execute("SHOW COLUMNS FROM questionnaires LIKE 'payload_sha1';")
+        if cur.fetchone() is None:
+            print("[schema] ALTER TABLE questionnaires ADD COLUMN payload_sha1")
+            cur.execute(
+                "ALTER TABLE questionnaires ADD COLUMN payload_sha1 CHAR(40) NOT NULL DEFAULT '' AFTER payload;"
+            )
+    conn.commit()
+
+
+# 复合索引：reclaim_expired 的 status + lock_expires_at 过滤、claim_one 的 status + qid 过滤都只走索引
+QUESTIONNAIRE_INDEXES = {
+    "idx_status_expires": "(status, lock_expires_at)",
+    "idx_status_qid": "(status, qid)",
+}
+
+
+def ensure_indexes(conn) -> None:
+    """
+    一次性迁移：给旧表补上新增的复合索引（CREATE TABLE IF NOT EXISTS 不会改已有表）。
+    先 SHOW INDEX 查已有索引名，只创建缺失的；旧的 idx_status 保留，不影响使用。
+    """
+    with conn.cursor() as cur:
+        cur.execute("SHOW INDEX FROM questionnaires;")
+        existing = {r["Key_name"] for r in cur.fetchall()}
+        for name, cols in QUESTIONNAIRE_INDEXES.items():
+            if name not in existing:
+                print(f"[schema] CREATE INDEX {name} ON questionnaires {cols}")
+                cur.execute(f"CREATE INDEX {name} ON questionnaires {cols};")
+    conn.commit()
 
 
 def reset_data(conn) -> None:
     """
     清空已有数据（重新导入用）
-    - TRUNCATE 会清空表并重置 AUTO_INCREMENT
+    - 一条 DROP TABLE 删掉两张表，再用 ensure_schema 按最新 DDL 重建（AUTO_INCREMENT 一并重置）
+    - 增量重新导入不需要 --reset：内容未变的问卷会按 payload_sha1 直接跳过
     """
     with conn.cursor() as cur:
-        cur.execute("TRUNCATE TABLE submissions;")
-        cur.execute("TRUNCATE TABLE questionnaires;")
+        cur.execute("DROP TABLE IF EXISTS submissions, questionnaires;")
     conn.commit()
+    ensure_schema(conn)
 
 
-def upsert_questionnaire(conn, qid: str, bank: str, rel_path: str, payload_obj: dict, question_count: int) -> None:
-    payload_json = json.dumps(payload_obj, ensure_ascii=False)
+def fetch_payload_hashes(conn) -> Dict[str, str]:
+    """
+    qid -> payload_sha1：导入前一次取回，内容未变的问卷直接跳过，不再重写整份 payload。
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT qid, payload_sha1 FROM questionnaires;")
+        return {r["qid"]: r["payload_sha1"] for r in cur.fetchall()}
+
+
+def upsert_questionnaires_bulk(conn, rows: List[Tuple[str, str, str, str, str, int]]) -> None:
+    """
+    批量 upsert：rows 为 (qid, bank, rel_path, payload_json, payload_sha1, question_count) 列表。
+    PyMySQL 的 executemany 会把 INSERT ... VALUES (...) ON DUPLICATE KEY UPDATE
+    折叠成一条多行 INSERT（超长时自动拆分），一个 batch 只需一次网络往返。
+    """
+    if not rows:
+        return
 
     # 默认：重复导入时不会覆盖 status/claimed 字段，避免把进行中/已完成状态冲掉
     sql = """
-    INSERT INTO questionnaires (qid, bank, rel_path, payload, question_count)
-    VALUES (%s, %s, %s, %s, %s)
+    INSERT INTO questionnaires (qid, bank, rel_path, payload, payload_sha1, question_count)
+    VALUES (%s, %s, %s, %s, %s, %s)
     ON DUPLICATE KEY UPDATE
       bank = VALUES(bank),
       rel_path = VALUES(rel_path),
       payload = VALUES(payload),
+      payload_sha1 = VALUES(payload_sha1),
       question_count = VALUES(question_count),
       updated_at = CURRENT_TIMESTAMP;
     """
     with conn.cursor() as cur:
-        cur.execute(sql, (qid, bank, rel_path, payload_json, question_count))
+        cur.executemany(sql, rows)
+
+
+def prepare_questionnaire(qf: Path, banks_dir: Path) -> Tuple[str, str, str, str, str, int]:
+    """
+    读取并序列化一份问卷（纯本地 IO + CPU，可在线程池中并行）。
+    返回 (qid, bank, rel_path, payload_json, payload_sha1, question_count)。
+    """
+    rel_path = qf.relative_to(banks_dir).as_posix()
+    bank = rel_path.split("/", 1)[0]
+    qid = rel_path  # 用相对路径作为全局唯一ID（简单且可溯源）
+
+    meta, questions = load_questionnaire_jsonl(qf)
+    # 直接按字节拼出 {"meta": ..., "questions": [...], "source": {...}}，题目行原样嵌入
+    source = _dumps({"bank": bank, "rel_path": rel_path})
+    payload = b"".join([
+        b'{"meta":', meta,
+        b',"questions":[', b",".join(questions),
+        b'],"source":', source, b"}",
+    ])
+
+    # 在线程池里就校验：坏行若留到 TiDB 写 JSON 列时才被拒绝，会让整批 executemany 失败且不指明文件
+    validate_payload(qf, payload, len(questions))
+
+    payload_sha1 = hashlib.sha1(payload).hexdigest()
+    return qid, bank, rel_path, payload.decode("utf-8"), payload_sha1, len(questions)
+
+
+def validate_payload(qf: Path, payload: bytes, question_count: int) -> None:
+    """
+    整体解析一次拼好的 payload；失败时再逐行定位，抛出带文件路径和行号的 ValueError。
+    每道题必须是单独一行的 JSON 对象（一行拼进多个值时题数对不上，同样报错）。
+    """
+    try:
+        obj = _loads(payload)
+    except ValueError:
+        obj = None
+    if obj is not None:
+        qs = obj["questions"]
+        if len(qs) == question_count and all(isinstance(q, dict) for q in qs):
+            return
+
+    with qf.open("rb") as f:
+        for lineno, ln in enumerate(f, start=1):
+            if not ln.strip():
+                continue
+            try:
+                item = _loads(ln)
+            except ValueError as e:
+                raise ValueError(f"{qf}: 第 {lineno} 行不是合法 JSON：{e}") from None
+            if not isinstance(item, dict):
+                raise ValueError(f"{qf}: 第 {lineno} 行不是单个 JSON 对象")
+    raise ValueError(f"{qf}: payload 不是合法 JSON")
+
+
+def default_import_cache_path(banks_dir: Path) -> Path:
+    """
+    默认缓存位置：banks_dir 旁边的 .import_cache_<目录名>.json。
+    放在输入目录之外，不会混进被扫描/被 git 跟踪的问卷目录；不同 banks_dir 各自一份。
+    """
+    return banks_dir.parent / f".import_cache_{banks_dir.name}.json"
+
+
+def load_import_cache(path: Path) -> Dict[str, List[Any]]:
+    """
+    本地导入缓存：rel_path -> [mtime_ns, size, payload_sha1]（上次成功导入时的文件指纹）。
+    文件不存在 / 损坏时视为空缓存。
+    """
+    try:
+        data = _loads(path.read_bytes())
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def save_import_cache(path: Path, cache: Dict[str, List[Any]]) -> None:
+    # 先写临时文件再 replace，避免中途中断留下半个缓存文件
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_bytes(_dumps(cache))
+    tmp.replace(path)
 
 
 def main():
@@ -149,6 +303,12 @@ def main():
     p.add_argument("--limit", type=int, default=0, help="只导入前 limit 份问卷（0 表示不限制）")
     p.add_argument("--dry_run", action="store_true", help="只扫描统计，不写入数据库")
     p.add_argument("--batch", type=int, default=200, help="每 batch 提交一次事务")
+    p.add_argument("--workers", type=int, default=8, help="并行读取/解析问卷文件的线程数")
+    p.add_argument(
+        "--cache_path",
+        default="",
+        help="mtime 导入缓存文件路径（默认 banks_dir 同级的 .import_cache_<banks_dir名>.json）",
+    )
 
     # ✅ 新增：是否清空已有数据后重新导入
     p.add_argument("--reset", action="store_true", help="清空 questionnaires/submissions 后重新导入（危险操作）")
@@ -168,6 +328,8 @@ def main():
         ca_path = str(Path(ca_path).resolve())
 
     qfiles = sorted(banks_dir.rglob("questionnaire_*.jsonl"))
+    # 缓存按完整扫描结果清理（不受 --limit 影响）：已删除/改名的文件不再保留条目
+    all_rel_paths = {qf.relative_to(banks_dir).as_posix() for qf in qfiles}
     if args.limit and args.limit > 0:
         qfiles = qfiles[: args.limit]
 
@@ -184,44 +346,68 @@ def main():
 
     conn = connect_tidb(args.host, args.port, args.user, password, args.database, ca_path)
     try:
-        ensure_schema(conn)
-
         if args.reset:
-            print("[reset] TRUNCATE submissions + questionnaires ...")
+            print("[reset] DROP + CREATE submissions, questionnaires ...")
             reset_data(conn)
             print("[reset] done.")
-
-        imported = 0
+            known_hashes: Dict[str, str] = {}  # 刚重建的空表，不需要再查
+        else:
+            ensure_schema(conn)
+            known_hashes = fetch_payload_hashes(conn)
+
+        # 先用 mtime/size 过一遍：文件没动过、且库里哈希仍等于上次导入的哈希 -> 不打开文件直接跳过
+        cache_path = Path(args.cache_path).resolve() if args.cache_path else default_import_cache_path(banks_dir)
+        import_cache = load_import_cache(cache_path)
+        stats: Dict[str, Tuple[int, int]] = {}
+        todo: List[Path] = []
+        skipped = 0
         for qf in qfiles:
             rel_path = qf.relative_to(banks_dir).as_posix()
-            bank = rel_path.split("/", 1)[0]
-            qid = rel_path  # 用相对路径作为全局唯一ID（简单且可溯源）
-
-            meta, questions = load_questionnaire_jsonl(qf)
-            payload = {
-                "meta": meta,
-                "questions": questions,
-                "source": {"bank": bank, "rel_path": rel_path},
-            }
-
-            upsert_questionnaire(
-                conn,
-                qid=qid,
-                bank=bank,
-                rel_path=rel_path,
-                payload_obj=payload,
-                question_count=len(questions),
-            )
-            imported += 1
-
-            if imported % args.batch == 0:
-                conn.commit()
-                print(f"[import] committed {imported}/{len(qfiles)}")
+            st = qf.stat()
+            stats[rel_path] = (st.st_mtime_ns, st.st_size)
+            cached = import_cache.get(rel_path)
+            if (
+                cached
+                and (cached[0], cached[1]) == stats[rel_path]
+                and known_hashes.get(rel_path) == cached[2]  # qid 即 rel_path
+            ):
+                skipped += 1
+                continue
+            todo.append(qf)
+        print(f"[scan] unchanged by mtime (not read): {skipped}, to process: {len(todo)}")
 
+        imported = 0
+        pending: List[Tuple[str, str, str, str, str, int]] = []
+        # 线程池并行读取/解析/序列化文件，主线程负责攒批写库；
+        # 每次只提交 2*batch 个文件，限制同时驻留内存的 payload 数量
+        chunk = max(1, 2 * args.batch)
+        with ThreadPoolExecutor(max_workers=max(1, args.workers)) as ex:
+            for start in range(0, len(todo), chunk):
+                for row in ex.map(prepare_questionnaire, todo[start:start + chunk], [banks_dir] * chunk):
+                    mtime_ns, size = stats[row[2]]
+                    import_cache[row[2]] = [mtime_ns, size, row[4]]
+                    if known_hashes.get(row[0]) == row[4]:
+                        skipped += 1  # 内容未变：跳过，不产生任何写入
+                        continue
+
+                    pending.append(row)
+                    imported += 1
+
+                    if len(pending) >= args.batch:
+                        upsert_questionnaires_bulk(conn, pending)
+                        conn.commit()
+                        pending.clear()
+                        print(f"[import] committed {imported}/{len(qfiles)} (unchanged skipped={skipped})")
+
+        upsert_questionnaires_bulk(conn, pending)
         conn.commit()
+        # 全部提交成功后才落盘缓存（中途失败时下次会重新处理）
+        save_import_cache(cache_path, {k: v for k, v in import_cache.items() if k in all_rel_paths})
         print(f"[OK] imported questionnaires: {imported}")
+        print(f"[OK] unchanged (skipped): {skipped}")
 
-        # 简单校验
+        # 简单校验（只读查询，切到 autocommit，不再开事务）
+        conn.autocommit(True)
         with conn.cursor() as cur:
             cur.execute("SELECT COUNT(*) AS cnt FROM questionnaires;")
             row = cur.fetchone()
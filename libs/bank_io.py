@@ -4,10 +4,31 @@
 from __future__ import annotations
 
 import json
+import mmap
+import os
 import time
 from pathlib import Path
 from typing import Any, Dict, List, Tuple
 
+try:
+    import orjson
+
+    _loads = orjson.loads
+
+    def _dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+except ImportError:  # 未安装 orjson 时退回标准库（json.loads 同样接受 bytes）
+    _loads = json.loads
+
+    # 与 orjson 相同的紧凑分隔符：装不装 orjson 输出的字节一致
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+    def _dumps(obj: Any) -> bytes:
+        return _encoder.encode(obj).encode("utf-8")
+
+
+_O_DSYNC = getattr(os, "O_DSYNC", 0)
+
 
 def load_questionnaire_jsonl(path: Path) -> Tuple[dict, List[Dict[str, Any]]]:
     """
@@ -15,28 +36,44 @@ def load_questionnaire_jsonl(path: Path) -> Tuple[dict, List[Dict[str, Any]]]:
     - 如果第 1 行是 {"__meta__": {...}}，则视为 meta 行
     - 否则 meta={}
     返回 (meta, questions)
+
+    用 mmap 映射文件，按换行符切行后直接把 bytes 交给 orjson 解析，不做整文件拷贝。
     """
-    lines = path.read_text(encoding="utf-8").splitlines()
-    if not lines:
-        return {}, []
+    loads = _loads
+    meta: dict = {}
+    questions: List[Dict[str, Any]] = []
 
-    first = lines[0].strip()
-    meta = {}
-    start = 0
-    try:
-        obj0 = json.loads(first)
-        if isinstance(obj0, dict) and "__meta__" in obj0:
-            meta = obj0["__meta__"] or {}
-            start = 1
-    except Exception:
-        pass
+    with path.open("rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return {}, []
 
-    questions: List[Dict[str, Any]] = []
-    for ln in lines[start:]:
-        ln = ln.strip()
-        if not ln:
-            continue
-        questions.append(json.loads(ln))
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            pos = 0
+            first = True
+            while pos < size:
+                end = mm.find(b"\n", pos)
+                if end < 0:
+                    end = size
+                ln = mm[pos:end]
+                pos = end + 1
+
+                if first:
+                    first = False
+                    try:
+                        obj0 = loads(ln)
+                    except ValueError:
+                        obj0 = None
+                    if isinstance(obj0, dict) and "__meta__" in obj0:
+                        meta = obj0["__meta__"] or {}
+                        continue
+
+                if not ln.strip():
+                    continue
+                questions.append(loads(ln))
+        finally:
+            mm.close()
     return meta, questions
 
 
@@ -48,9 +85,29 @@ def atomic_write_jsonl(path: Path, meta: dict, questions: List[Dict[str, Any]])
     """
     原子写回：写到临时文件，再 replace 覆盖，避免并发/中途崩溃导致文件损坏。
     """
+    dumps = _dumps
+    parts = [dumps({"__meta__": meta})]
+    append = parts.append
+    for q in questions:
+        append(dumps(q))
+    append(b"")  # join 之后末尾带换行
+    buf = b"\n".join(parts)
+
+    # 整份内容序列化到一个 buffer，再用裸 fd 一次性写出；
+    # 支持 O_DSYNC 的平台上落盘随 write 完成，无需再单独 fsync
     tmp = path.with_suffix(path.suffix + f".tmp_{int(time.time()*1000)}")
-    with tmp.open("w", encoding="utf-8") as f:
-        f.write(json.dumps({"__meta__": meta}, ensure_ascii=False) + "\n")
-        for q in questions:
-            f.write(json.dumps(q, ensure_ascii=False) + "\n")
-    tmp.replace(path)
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | _O_DSYNC | getattr(os, "O_BINARY", 0)
+    fd = os.open(str(tmp), flags, 0o644)
+    try:
+        view = memoryview(buf)
+        while view:
+            n = os.write(fd, view)
+            view = view[n:]
+        if not _O_DSYNC:
+            os.fsync(fd)
+        # 已落盘的问卷很少再被读取，提示内核丢弃对应页缓存，避免挤占小内存实例的 page cache
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+    os.replace(tmp, path)
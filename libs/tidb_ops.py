@@ -5,10 +5,29 @@ from __future__ import annotations
 
 import json
 import os
+import queue
+import random
+import time
+from contextlib import contextmanager
 from dataclasses import dataclass
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 import pymysql
+from pymysql.constants import ER
+
+try:
+    import orjson
+
+    _loads = orjson.loads
+
+    def _dumps_str(obj: Any) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+except ImportError:  # 未安装 orjson 时退回标准库
+    _loads = json.loads
+
+    def _dumps_str(obj: Any) -> str:
+        # 与 orjson 相同的紧凑分隔符：装不装 orjson 输出的字节一致
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
 
 
 @dataclass
@@ -29,9 +48,26 @@ class TiDBOps:
     - refresh_lock: 续租 TTL（防止做题中被回收）
     - abandon: 放弃问卷（改回 available）
     - submit: 提交答案（写 submissions + 标记 done）
+    - submit_many: 批量提交（回填/迁移用，一个事务）
     - reclaim_expired: 回收过期 in_progress
+
+    连接复用：内部维护一个大小为 pool_size 的连接池（queue.Queue，线程安全），
+    避免每次操作都重新做 TCP + TLS 握手；出错的连接直接丢弃，空闲过久的连接取出时先 ping。
     """
 
+    # 连接空闲超过该秒数，取出时先 ping（必要时自动重连），避免拿到已被服务端断开的连接
+    IDLE_PING_SECONDS = 60
+    # claim_one 每次随机抽取的候选问卷数
+    CLAIM_SAMPLE_SIZE = 8
+    # 建连（包括 ping 触发的自动重连）时执行的会话设置：打开 TiDB 的非预处理计划缓存，
+    # 同一条 SQL（仅参数不同）复用执行计划。_for_dml 覆盖 refresh_lock/submit 等 UPDATE/INSERT。
+    # 老版本 TiDB 不认识变量时（1193）依次退到下一条，全部不支持则不设置
+    PLAN_CACHE_INIT_COMMANDS = (
+        "SET SESSION tidb_enable_non_prepared_plan_cache = ON, "
+        "tidb_enable_non_prepared_plan_cache_for_dml = ON",
+        "SET SESSION tidb_enable_non_prepared_plan_cache = ON",
+    )
+
     def __init__(
         self,
         host: str,
@@ -40,6 +76,7 @@ class TiDBOps:
         password: str,
         database: str,
         ca_path: str | None = None,
+        pool_size: int = 4,
     ) -> None:
         self.host = host
         self.port = port
@@ -47,37 +84,99 @@ class TiDBOps:
         self.password = password
         self.database = database
         self.ca_path = ca_path
+        # 池中元素：(conn, 上次归还时间)
+        self._pool: "queue.Queue[tuple]" = queue.Queue(maxsize=max(1, pool_size))
+        self._init_commands = list(self.PLAN_CACHE_INIT_COMMANDS)
 
     def connect(self):
         ssl = None
         if self.ca_path:
             ssl = {"ca": self.ca_path}
 
-        return pymysql.connect(
-            host=self.host,
-            port=self.port,
-            user=self.user,
-            password=self.password,
-            database=self.database,
-            charset="utf8mb4",
-            cursorclass=pymysql.cursors.DictCursor,
-            autocommit=False,
-            ssl=ssl,
-            connect_timeout=10,
-            read_timeout=30,
-            write_timeout=30,
-        )
+        while True:
+            # 通过 init_command 设置：PyMySQL 每次（重）连接都会重新执行，ping(reconnect=True) 后也不会丢失
+            init_command = self._init_commands[0] if self._init_commands else None
+            try:
+                return pymysql.connect(
+                    host=self.host,
+                    port=self.port,
+                    user=self.user,
+                    password=self.password,
+                    database=self.database,
+                    charset="utf8mb4",
+                    cursorclass=pymysql.cursors.DictCursor,
+                    autocommit=False,
+                    ssl=ssl,
+                    connect_timeout=10,
+                    read_timeout=30,
+                    write_timeout=30,
+                    init_command=init_command,
+                )
+            except pymysql.err.MySQLError as e:
+                if init_command is None or not e.args or e.args[0] != ER.UNKNOWN_SYSTEM_VARIABLE:
+                    raise
+                # 并发建连时可能已被其他线程退过一级
+                if self._init_commands and self._init_commands[0] == init_command:
+                    self._init_commands.pop(0)
+
+    def _get_conn(self):
+        try:
+            conn, last_used = self._pool.get_nowait()
+        except queue.Empty:
+            return self.connect()
+        if time.time() - last_used > self.IDLE_PING_SECONDS:
+            try:
+                conn.ping(reconnect=True)
+            except Exception:
+                self._close_quietly(conn)
+                return self.connect()
+        return conn
+
+    def _put_conn(self, conn) -> None:
+        try:
+            self._pool.put_nowait((conn, time.time()))
+        except queue.Full:
+            self._close_quietly(conn)
+
+    @staticmethod
+    def _close_quietly(conn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def _conn(self) -> Iterator[Any]:
+        """
+        从池中借一个连接，用完归还。
+        - OperationalError（如 2006 server has gone away / 2013 lost connection）：丢弃该连接，下次自动新建
+        - 其他异常：先 rollback 清掉未完成的事务再归还；rollback 也失败则丢弃
+        """
+        conn = self._get_conn()
+        try:
+            yield conn
+        except pymysql.err.OperationalError:
+            self._close_quietly(conn)
+            raise
+        except BaseException:
+            try:
+                conn.rollback()
+            except Exception:
+                self._close_quietly(conn)
+            else:
+                self._put_conn(conn)
+            raise
+        else:
+            self._put_conn(conn)
 
     @staticmethod
     def _parse_payload(payload_value) -> Dict[str, Any]:
         if isinstance(payload_value, dict):
             return payload_value
-        if isinstance(payload_value, (bytes, bytearray)):
-            payload_value = payload_value.decode("utf-8", errors="ignore")
-        if isinstance(payload_value, str):
-            return json.loads(payload_value)
+        if isinstance(payload_value, (bytes, bytearray, str)):
+            return _loads(payload_value)  # orjson 直接解析 str/bytes，无需先 decode
         # fallback
-        return json.loads(str(payload_value))
+        return _loads(str(payload_value))
 
     def reclaim_expired(self, ttl_seconds: int) -> int:
         """
@@ -94,30 +193,43 @@ class TiDBOps:
           AND lock_expires_at IS NOT NULL
           AND lock_expires_at < NOW();
         """
-        conn = self.connect()
-        try:
+        with self._conn() as conn:
             with conn.cursor() as cur:
                 cur.execute(sql)
                 n = cur.rowcount
             conn.commit()
             return n
-        finally:
-            conn.close()
 
     def claim_one(self, sid: str, ttl_seconds: int, max_retries: int = 5) -> Optional[QuestionnaireRow]:
         """
         高并发安全领取一份问卷：
         - 先回收过期锁（不在事务里也行，这里简单起见每次领取前做一次）
-        - 事务中 SELECT ... FOR UPDATE 锁定一条 available 记录
+        - 在服务端随机取候选：COUNT 出 available 的数量，在 idx_status_qid (status, qid) 上按随机 OFFSET
+          取连续 CLAIM_SAMPLE_SIZE 个 qid（覆盖索引，不读 payload，只有这几个 qid 经网络传回）
+        - 事务中 SELECT ... WHERE qid IN (候选) ... FOR UPDATE 锁定其中一条仍为 available 的记录
+          （主键点查，替代 ORDER BY RAND() 的全量扫描 + 排序，锁范围只有候选行）
         - UPDATE 置为 in_progress + claimed_by + lock_expires_at
         """
         self.reclaim_expired(ttl_seconds)
 
+        count_sql = """
+        SELECT COUNT(*) AS n
+        FROM questionnaires
+        WHERE status='available';
+        """
+
+        ids_sql = """
+        SELECT qid
+        FROM questionnaires
+        WHERE status='available'
+        ORDER BY qid
+        LIMIT %s OFFSET %s;
+        """
+
         select_sql = """
         SELECT qid, bank, rel_path, payload, question_count, status, claimed_by
         FROM questionnaires
-        WHERE status='available'
-        ORDER BY RAND()
+        WHERE qid IN ({placeholders}) AND status='available'
         LIMIT 1
         FOR UPDATE;
         """
@@ -132,15 +244,28 @@ class TiDBOps:
         """
 
         for _ in range(max_retries):
-            conn = self.connect()
-            try:
+            with self._conn() as conn:
                 with conn.cursor() as cur:
+                    cur.execute(count_sql)
+                    n_available = int(cur.fetchone()["n"])
+                    if n_available == 0:
+                        conn.commit()
+                        return None
+                    k = self.CLAIM_SAMPLE_SIZE
+                    cur.execute(ids_sql, (k, random.randrange(max(1, n_available - k + 1))))
+                    candidates = [r["qid"] for r in cur.fetchall()]
+                    conn.commit()
+                    if not candidates:
+                        # 计数之后有问卷被领走，OFFSET 越界：重新抽
+                        continue
+
                     conn.begin()
-                    cur.execute(select_sql)
+                    cur.execute(select_sql.format(placeholders=", ".join(["%s"] * len(candidates))), candidates)
                     row = cur.fetchone()
                     if not row:
+                        # 候选刚好都被别人抢走：重新抽样
                         conn.rollback()
-                        return None
+                        continue
 
                     qid = row["qid"]
                     cur.execute(update_sql, (sid, int(ttl_seconds), qid))
@@ -160,8 +285,6 @@ class TiDBOps:
                         status="in_progress",
                         claimed_by=sid,
                     )
-            finally:
-                conn.close()
 
         return None
 
@@ -175,15 +298,12 @@ class TiDBOps:
         SET lock_expires_at=DATE_ADD(NOW(), INTERVAL %s SECOND)
         WHERE qid=%s AND status='in_progress' AND claimed_by=%s;
         """
-        conn = self.connect()
-        try:
+        with self._conn() as conn:
             with conn.cursor() as cur:
                 cur.execute(sql, (int(ttl_seconds), qid, sid))
                 ok = (cur.rowcount == 1)
             conn.commit()
             return ok
-        finally:
-            conn.close()
 
     def abandon(self, qid: str, sid: str) -> bool:
         """
@@ -197,15 +317,12 @@ class TiDBOps:
             lock_expires_at=NULL
         WHERE qid=%s AND status='in_progress' AND claimed_by=%s;
         """
-        conn = self.connect()
-        try:
+        with self._conn() as conn:
             with conn.cursor() as cur:
                 cur.execute(sql, (qid, sid))
                 ok = (cur.rowcount == 1)
             conn.commit()
             return ok
-        finally:
-            conn.close()
 
     def submit(self, qid: str, sid: str, answers: Dict[str, str]) -> bool:
         """
@@ -234,8 +351,7 @@ class TiDBOps:
         WHERE qid=%s AND status='in_progress' AND claimed_by=%s;
         """
 
-        conn = self.connect()
-        try:
+        with self._conn() as conn:
             with conn.cursor() as cur:
                 conn.begin()
                 cur.execute(select_sql, (qid,))
@@ -256,7 +372,7 @@ class TiDBOps:
                     conn.rollback()
                     return False
 
-                answers_json = json.dumps(answers, ensure_ascii=False)
+                answers_json = _dumps_str(answers)
                 cur.execute(insert_sql, (qid, sid, answers_json))
                 cur.execute(update_sql, (qid, sid))
                 if cur.rowcount != 1:
@@ -265,5 +381,67 @@ class TiDBOps:
 
                 conn.commit()
                 return True
-        finally:
-            conn.close()
+
+    def submit_many(self, records: List[Tuple[str, str, Dict[str, str]]]) -> List[bool]:
+        """
+        批量提交（回填 / 离线迁移用）：records 为 (qid, sid, answers) 列表，返回与之对齐的成功标记。
+        单条语义与 submit 相同（已 done 视为成功；必须 in_progress 且 claimed_by=sid），但整批只用一个事务：
+        - 一条 SELECT ... WHERE qid IN (...) FOR UPDATE 批量锁定并校验
+        - 一条多行 INSERT 写 submissions
+        - 一条 UPDATE ... WHERE qid IN (...) 标记 done
+        """
+        if not records:
+            return []
+
+        qids = list(dict.fromkeys(qid for qid, _, _ in records))
+        placeholders = ", ".join(["%s"] * len(qids))
+
+        select_sql = f"""
+        SELECT qid, status, claimed_by
+        FROM questionnaires
+        WHERE qid IN ({placeholders})
+        FOR UPDATE;
+        """
+
+        insert_sql = """
+        INSERT INTO submissions (qid, sid, answers)
+        VALUES (%s, %s, %s);
+        """
+
+        update_sql = """
+        UPDATE questionnaires
+        SET status='done',
+            lock_expires_at=NULL
+        WHERE qid IN ({placeholders}) AND status='in_progress';
+        """
+
+        with self._conn() as conn:
+            with conn.cursor() as cur:
+                conn.begin()
+                cur.execute(select_sql, qids)
+                state = {r["qid"]: (str(r["status"]), r["claimed_by"]) for r in cur.fetchall()}
+
+                results: List[bool] = []
+                rows: List[Tuple[str, str, str]] = []
+                for qid, sid, answers in records:
+                    status, claimed_by = state.get(qid, (None, None))
+                    if status == "done":
+                        # 已完成则认为提交成功（幂等）
+                        results.append(True)
+                    elif status == "in_progress" and claimed_by == sid:
+                        rows.append((qid, sid, _dumps_str(answers)))
+                        state[qid] = ("done", claimed_by)  # 同一批里重复的 qid 只写一次
+                        results.append(True)
+                    else:
+                        results.append(False)
+
+                if rows:
+                    cur.executemany(insert_sql, rows)
+                    done_qids = [qid for qid, _, _ in rows]
+                    cur.execute(update_sql.format(placeholders=", ".join(["%s"] * len(done_qids))), done_qids)
+                    if cur.rowcount != len(done_qids):
+                        conn.rollback()
+                        return [False] * len(records)
+
+                conn.commit()
+                return results
@@ -0,0 +1,48 @@
+# streamlit_annotator/libs/ui_common.py
+# -*- coding: utf-8 -*-
+
+from __future__ import annotations
+
+import functools
+import re
+from typing import List
+
+import streamlit as st
+
+
+_SID_RE = re.compile(r"\d{10}")
+
+
+@functools.lru_cache(maxsize=1024)
+def validate_sid(sid: str) -> bool:
+    """学号：10 位数字。登录/再领取时都会调用，同一学号重复校验直接命中缓存。"""
+    return _SID_RE.fullmatch(sid) is not None
+
+
+# --- dialog compatibility ---
+DIALOG_DECORATOR = getattr(st, "dialog", None) or getattr(st, "experimental_dialog", None)
+
+if DIALOG_DECORATOR:
+    @DIALOG_DECORATOR("⚠️ 还有题目未作答")
+    def missing_dialog(missing_numbers: List[int], first_missing_page: int):
+        st.warning("请先完成以下题目再提交：")
+        if len(missing_numbers) <= 200:
+            st.write("未作答题号：", ", ".join(map(str, missing_numbers)))
+        else:
+            st.write("未作答题号（前200题）：", ", ".join(map(str, missing_numbers[:200])))
+            st.caption(f"（共 {len(missing_numbers)} 题未作答，已省略后续题号）")
+
+        c1, c2 = st.columns([1, 1])
+        with c1:
+            if st.button("跳转到第一题未做"):
+                st.session_state["page"] = first_missing_page
+                st.rerun()
+        with c2:
+            if st.button("继续作答"):
+                st.rerun()
+else:
+    def missing_dialog(missing_numbers: List[int], first_missing_page: int):
+        st.warning("还有题目未作答： " + ", ".join(map(str, missing_numbers[:200])))
+        if st.button("跳转到第一题未做"):
+            st.session_state["page"] = first_missing_page
+            st.rerun()
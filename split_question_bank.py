@@ -4,41 +4,94 @@
 from __future__ import annotations
 
 import argparse
-import copy
-import hashlib
 import json
 import random
 from pathlib import Path
 from typing import Any, Dict, List
 
+import numpy as np
+
+try:
+    import orjson
+
+    _loads = orjson.loads
+
+    def _dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+except ImportError:  # 未安装 orjson 时退回标准库（json.loads 同样接受 bytes）
+    _loads = json.loads
+
+    def _dumps(obj: Any) -> bytes:
+        # 与 orjson 相同的紧凑分隔符：两条路径输出的字节一致
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+try:
+    from numba import njit
+except ImportError:  # numba 可选：未安装时用 numpy 版本
+    njit = None
+
+
+def _pick_buckets_np(counts: np.ndarray, candidates: np.ndarray, tiebreak: np.ndarray, n: int) -> np.ndarray:
+    # sort by current load, tie-break random（lexsort 以最后一个 key 为主键）
+    order = np.lexsort((tiebreak, counts[candidates]))
+    return candidates[order[:n]]
+
+
+if njit is not None:
+
+    @njit(cache=True)
+    def _pick_buckets_nb(counts, candidates, tiebreak, n):
+        # 部分选择排序：取 (load, tiebreak) 最小的 n 个，结果与 _pick_buckets_np 完全一致
+        k = candidates.size
+        taken = np.zeros(k, dtype=np.bool_)
+        out = np.empty(n, dtype=candidates.dtype)
+        for j in range(n):
+            best = -1
+            for i in range(k):
+                if taken[i]:
+                    continue
+                if best < 0:
+                    best = i
+                    continue
+                li = counts[candidates[i]]
+                lb = counts[candidates[best]]
+                if li < lb or (li == lb and tiebreak[i] < tiebreak[best]):
+                    best = i
+            taken[best] = True
+            out[j] = candidates[best]
+        return out
+
+    pick_buckets = _pick_buckets_nb
+else:
+    pick_buckets = _pick_buckets_np
+
 
 def load_json_or_jsonl(path: Path) -> List[Dict[str, Any]]:
-    text = path.read_text(encoding="utf-8").strip()
-    if not text:
+    raw = path.read_bytes().strip()
+    if not raw:
         return []
-    if text[0] == "[":
-        data = json.loads(text)
+    if raw[:1] == b"[":
+        data = _loads(raw)
         if not isinstance(data, list):
             raise ValueError(f"{path} is JSON but not a list.")
         return [x for x in data if isinstance(x, dict)]
     rows = []
-    for line in text.splitlines():
+    for line in raw.split(b"\n"):
         line = line.strip()
         if not line:
             continue
-        rows.append(json.loads(line))
+        rows.append(_loads(line))
     return [x for x in rows if isinstance(x, dict)]
 
 
 def write_jsonl(path: Path, items: List[Dict[str, Any]]) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("w", encoding="utf-8") as f:
-        for obj in items:
-            f.write(json.dumps(obj, ensure_ascii=False) + "\n")
-
-
-def stable_hash(s: str) -> str:
-    return hashlib.sha1(s.encode("utf-8")).hexdigest()
+    # orjson 直接产出 UTF-8 bytes：拼成一个 buffer 一次写出。
+    # 注意输出是紧凑 JSON（{"a":1}），与早先 json.dumps 默认的 {"a": 1} 内容等价但字节不同，
+    # 重新切分后已入库的 data/ 切分文件会整体出现 diff
+    parts = [_dumps(obj) for obj in items]
+    parts.append(b"")
+    path.write_bytes(b"\n".join(parts))
 
 
 def split_bank(
@@ -53,6 +106,9 @@ def split_bank(
     且每份问卷内同一 qid 不重复。
 
     算法：多次尝试（不同随机种子偏移），每次用“容量约束 + 最少负载优先”的贪心分配。
+    每题只分配一次、且一次选 n 个不同的 bucket，所以“bucket 内 qid 不重复”天然成立，
+    候选只需按容量过滤；负载用 numpy 数组维护，选桶见 pick_buckets。
+    （只有题库里本身存在重复 qid 时才可能同桶重复，由最后的向量化校验兜底。）
     """
     if m <= 0 or n <= 0:
         raise ValueError("m and n must be positive integers.")
@@ -76,16 +132,21 @@ def split_bank(
 
     # For reproducibility: use deterministic order of items, then shuffle per attempt
     base_items = list(bank)
+    # qid -> 整数编号，用于最后的去重校验
+    qid_code = {q: i for i, q in enumerate(dict.fromkeys(it["qid"] for it in bank))}
 
     for attempt in range(max_attempts):
         rng = random.Random(seed + attempt * 10007)
+        np_rng = np.random.default_rng(seed + attempt * 10007)
 
         items = base_items[:]
         rng.shuffle(items)
 
         buckets: List[List[Dict[str, Any]]] = [[] for _ in range(m)]
-        bucket_qids = [set() for _ in range(m)]
-        counts = [0] * m
+        counts = np.zeros(m, dtype=np.int64)
+        # 每次分配记录 bucket * U + qid 编号，校验时一次 np.unique 判断“同桶同 qid”
+        pair_keys: List[int] = []
+        U = len(qid_code)
 
         ok = True
 
@@ -94,38 +155,31 @@ def split_bank(
         for it in items:
             qid = it["qid"]
 
-            # candidate indices where:
-            # - not already have this qid (always true here if we assign at most once per bucket)
-            # - not full
-            candidates = [i for i in range(m) if counts[i] < target_len and qid not in bucket_qids[i]]
-            if len(candidates) < n:
+            # candidate indices where: not full
+            candidates = np.flatnonzero(counts < target_len)
+            if candidates.size < n:
                 ok = False
                 break
 
-            # sort by current load, tie-break random
-            candidates.sort(key=lambda i: (counts[i], rng.random()))
-
-            chosen = candidates[:n]
+            # 最少负载优先，负载相同随机打破（装了 numba 时走 JIT 内核）
+            chosen = pick_buckets(counts, candidates, np_rng.random(candidates.size), n).tolist()
+            code = qid_code[qid]
+            pair_keys.extend(bi * U + code for bi in chosen)
             for bi in chosen:
                 # add a per-assignment unique id for traceability
-                assigned = copy.deepcopy(it)
+                # 只新增 instance_id 一个顶层字段：浅拷贝即可，嵌套字段与原题共享（只读）
+                assigned = dict(it)
                 assigned["instance_id"] = f"{qid}#{attempt}-{bi}-{counts[bi]}"
                 buckets[bi].append(assigned)
-                bucket_qids[bi].add(qid)
                 counts[bi] += 1
 
         if not ok:
             continue
 
         # verify exact sizes and no duplicates
-        if any(c != target_len for c in counts):
+        if (counts != target_len).any():
             continue
-        for bi in range(m):
-            qids = [x["qid"] for x in buckets[bi]]
-            if len(qids) != len(set(qids)):
-                ok = False
-                break
-        if not ok:
+        if np.unique(np.asarray(pair_keys, dtype=np.int64)).size != len(pair_keys):
             continue
 
         # shuffle within each questionnaire
@@ -135,16 +189,18 @@ def split_bank(
 
         # ensure no identical questionnaires (same qid order)
         # extremely unlikely, but enforce by reshuffling colliding ones.
+        # 只在本次运行内判重：直接用 qid 元组的内置 hash，不再 "|".join + sha1
+        # （hash 偶然碰撞只会多做一次重排，不影响正确性）
         seen = {}
         for bi in range(m):
-            sig = stable_hash("|".join([x["qid"] for x in buckets[bi]]))
+            sig = hash(tuple([x["qid"] for x in buckets[bi]]))
             if sig in seen:
                 # collision, reshuffle a few times
                 collision_ok = False
                 for t in range(20):
                     rng_b = random.Random(seed + attempt * 10007 + bi * 97 + (t + 1) * 99991)
                     rng_b.shuffle(buckets[bi])
-                    sig2 = stable_hash("|".join([x["qid"] for x in buckets[bi]]))
+                    sig2 = hash(tuple([x["qid"] for x in buckets[bi]]))
                     if sig2 not in seen:
                         seen[sig2] = bi
                         collision_ok = True
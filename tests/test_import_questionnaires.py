@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import annotations
+
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from typing import Dict, List
+from unittest import mock
+
+import import_questionnaires_tidb
+from import_questionnaires_tidb import prepare_questionnaire
+
+
+class FakeImportConn:
+    """
+    只实现 import 脚本用到的语句：schema 检查、qid -> payload_sha1 查询、批量 upsert、最后的 COUNT。
+    hashes 跨多次 main() 保留，模拟同一张表。
+    """
+
+    def __init__(self, hashes: Dict[str, str]) -> None:
+        self.hashes = hashes
+        self.upserted: List[str] = []
+
+    def cursor(self, *args):
+        return FakeImportCursor(self)
+
+    def commit(self) -> None:
+        pass
+
+    def autocommit(self, value: bool) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class FakeImportCursor:
+    def __init__(self, conn: FakeImportConn) -> None:
+        self.conn = conn
+        self._rows: List[dict] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql: str, params=()) -> None:
+        sql = " ".join(sql.split())
+        self._rows = []
+        if sql.startswith("CREATE TABLE"):
+            return
+        if sql.startswith("SHOW COLUMNS"):
+            self._rows = [{"Field": "payload_sha1"}]
+        elif sql.startswith("SHOW INDEX"):
+            self._rows = [{"Key_name": k} for k in import_questionnaires_tidb.QUESTIONNAIRE_INDEXES]
+        elif sql.startswith("SELECT qid, payload_sha1"):
+            self._rows = [{"qid": k, "payload_sha1": v} for k, v in self.conn.hashes.items()]
+        elif sql.startswith("SELECT COUNT(*) AS cnt"):
+            self._rows = [{"cnt": len(self.conn.hashes)}]
+        else:
+            raise AssertionError(f"unexpected SQL: {sql}")
+
+    def executemany(self, sql: str, rows) -> None:
+        assert " ".join(sql.split()).startswith("INSERT INTO questionnaires"), sql
+        for qid, _bank, _rel, _payload, sha1, _count in rows:
+            self.conn.hashes[qid] = sha1
+            self.conn.upserted.append(qid)
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self):
+        return list(self._rows)
+
+
+class PrepareQuestionnaireTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.banks_dir = Path(self._tmp.name)
+        (self.banks_dir / "bank_a").mkdir()
+        self.qf = self.banks_dir / "bank_a" / "questionnaire_001.jsonl"
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_payload_from_raw_lines(self):
+        self.qf.write_text('{"__meta__": {"n": 1}}\n{"qid": "a"}\n\n{"qid": "b"}\n', encoding="utf-8")
+        qid, bank, rel_path, payload, _sha1, count = prepare_questionnaire(self.qf, self.banks_dir)
+        self.assertEqual((qid, bank, rel_path, count), ("bank_a/questionnaire_001.jsonl", "bank_a", qid, 2))
+        self.assertEqual(
+            json.loads(payload),
+            {"meta": {"n": 1}, "questions": [{"qid": "a"}, {"qid": "b"}],
+             "source": {"bank": "bank_a", "rel_path": rel_path}},
+        )
+
+    def test_malformed_line_names_file_and_line(self):
+        for bad in ('{"qid": "b"', '{"qid": "b"}, {"qid": "c"}', "[1]"):
+            self.qf.write_text('{"__meta__": {}}\n{"qid": "a"}\n' + bad + "\n", encoding="utf-8")
+            with self.assertRaises(ValueError) as cm:
+                prepare_questionnaire(self.qf, self.banks_dir)
+            self.assertIn(str(self.qf), str(cm.exception))
+            self.assertIn("第 3 行", str(cm.exception))
+
+
+class ImportSkipTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self._tmp.name)
+        self.banks_dir = self.root / "questions"
+        (self.banks_dir / "bank_a").mkdir(parents=True)
+        self.files = []
+        for i in range(3):
+            qf = self.banks_dir / "bank_a" / f"questionnaire_{i:03d}.jsonl"
+            qf.write_text('{"__meta__": {}}\n{"qid": "q%d"}\n' % i, encoding="utf-8")
+            self.files.append(qf)
+        self.hashes: Dict[str, str] = {}
+        self.cache_path = self.root / ".import_cache_questions.json"
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def run_import(self, *extra: str):
+        """跑一次 main()，返回 (本次 upsert 的 qid, 本次真正读取的文件 rel_path)。"""
+        conn = FakeImportConn(self.hashes)
+        read: List[str] = []
+        real_prepare = import_questionnaires_tidb.prepare_questionnaire
+
+        def prepare(qf, banks_dir):
+            read.append(qf.relative_to(banks_dir).as_posix())
+            return real_prepare(qf, banks_dir)
+
+        argv = ["import_questionnaires_tidb.py", "--banks_dir", str(self.banks_dir), *extra]
+        with mock.patch.object(import_questionnaires_tidb, "connect_tidb", return_value=conn), \
+                mock.patch.object(import_questionnaires_tidb, "prepare_questionnaire", prepare), \
+                mock.patch.dict(os.environ, {"TIDB_PASSWORD": "x"}), \
+                mock.patch.object(sys, "argv", argv), \
+                contextlib.redirect_stdout(io.StringIO()):
+            import_questionnaires_tidb.main()
+        return sorted(conn.upserted), sorted(read)
+
+    def rel(self, qf: Path) -> str:
+        return qf.relative_to(self.banks_dir).as_posix()
+
+    def test_unchanged_payload_is_not_rewritten(self):
+        upserted, _ = self.run_import()
+        self.assertEqual(upserted, sorted(self.rel(f) for f in self.files))
+
+        # 文件 mtime 变了但内容没变：会读取，但按 payload_sha1 跳过写入
+        st = self.files[0].stat()
+        os.utime(self.files[0], ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        upserted, read = self.run_import()
+        self.assertEqual(read, [self.rel(self.files[0])])
+        self.assertEqual(upserted, [])
+
+        # 内容变了：重新写入
+        self.files[1].write_text('{"__meta__": {}}\n{"qid": "changed"}\n', encoding="utf-8")
+        upserted, read = self.run_import()
+        self.assertEqual(upserted, [self.rel(self.files[1])])
+
+    def test_mtime_cache_skips_reading_and_lives_outside_banks_dir(self):
+        self.run_import()
+        self.assertTrue(self.cache_path.exists())
+        self.assertEqual(list(self.banks_dir.rglob(".import_cache*")), [])
+
+        upserted, read = self.run_import()
+        self.assertEqual((upserted, read), ([], []))
+
+        # 库里的哈希被改掉（例如别处重新导入过）：即使 mtime 未变也要重新读取
+        self.hashes[self.rel(self.files[2])] = "stale"
+        upserted, read = self.run_import()
+        self.assertEqual(read, [self.rel(self.files[2])])
+        self.assertEqual(upserted, [self.rel(self.files[2])])
+
+    def test_cache_prunes_deleted_files_but_not_limit_skipped_ones(self):
+        self.run_import()
+        self.files[0].unlink()
+        self.run_import("--limit", "1")
+        cache = json.loads(self.cache_path.read_text(encoding="utf-8"))
+        self.assertEqual(sorted(cache), sorted(self.rel(f) for f in self.files[1:]))
+
+    def test_cache_path_flag(self):
+        custom = self.root / "elsewhere" / "cache.json"
+        custom.parent.mkdir()
+        self.run_import("--cache_path", str(custom))
+        self.assertTrue(custom.exists())
+        self.assertFalse(self.cache_path.exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
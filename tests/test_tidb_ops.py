@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import annotations
+
+import json
+import re
+import unittest
+from typing import Any, Dict, List, Optional
+
+import pymysql
+
+from libs.tidb_ops import TiDBOps
+
+
+def _norm(sql: str) -> str:
+    return " ".join(sql.split())
+
+
+class FakeDB:
+    """
+    内存里的 questionnaires / submissions，只认 TiDBOps 实际发出的几条 SQL。
+    """
+
+    def __init__(self, qids: List[str]) -> None:
+        self.questionnaires: Dict[str, Dict[str, Any]] = {
+            q: {"qid": q, "bank": "b", "rel_path": q, "payload": json.dumps({"questions": []}),
+                "question_count": 0, "status": "available", "claimed_by": None}
+            for q in qids
+        }
+        self.submissions: List[tuple] = []
+        self.statements: List[str] = []
+        # 模拟并发：批量 UPDATE ... status='done' 时少命中几行
+        self.done_update_shortfall = 0
+
+
+class FakeCursor:
+    def __init__(self, conn: "FakeConn") -> None:
+        self.conn = conn
+        self.db = conn.db
+        self._rows: List[dict] = []
+        self.rowcount = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def fetchone(self) -> Optional[dict]:
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self) -> List[dict]:
+        return list(self._rows)
+
+    def executemany(self, sql: str, rows) -> None:
+        sql = _norm(sql)
+        self.db.statements.append(sql)
+        assert sql.startswith("INSERT INTO submissions"), sql
+        self.conn.pending.extend(("insert", r) for r in rows)
+        self.rowcount = len(rows)
+
+    def execute(self, sql: str, params=()) -> None:
+        sql = _norm(sql)
+        self.db.statements.append(sql)
+        qs = self.db.questionnaires
+        self._rows, self.rowcount = [], 0
+
+        if sql.startswith("UPDATE questionnaires SET status='available'") and "lock_expires_at < NOW()" in sql:
+            return
+        if sql.startswith("SELECT COUNT(*) AS n FROM questionnaires WHERE status='available'"):
+            self._rows = [{"n": sum(r["status"] == "available" for r in qs.values())}]
+            return
+        m = re.match(r"SELECT qid FROM questionnaires WHERE status='available' ORDER BY qid LIMIT %s OFFSET %s", sql)
+        if m:
+            limit, offset = params
+            avail = sorted(q for q, r in qs.items() if r["status"] == "available")
+            self._rows = [{"qid": q} for q in avail[offset:offset + limit]]
+            return
+        if sql.startswith("SELECT qid, bank, rel_path, payload"):
+            hit = [dict(qs[q]) for q in params if q in qs and qs[q]["status"] == "available"]
+            self._rows = hit[:1]
+            return
+        if sql.startswith("SELECT qid, status, claimed_by FROM questionnaires WHERE qid IN"):
+            self._rows = [dict(qs[q]) for q in params if q in qs]
+            return
+        if sql.startswith("UPDATE questionnaires SET status='in_progress'"):
+            sid, _ttl, qid = params
+            if qid in qs and qs[qid]["status"] == "available":
+                self.conn.pending.append(("claim", (qid, sid)))
+                self.rowcount = 1
+            return
+        if sql.startswith("UPDATE questionnaires SET status='done'") and "qid IN" in sql:
+            hit = [q for q in params if q in qs and qs[q]["status"] == "in_progress"]
+            hit = hit[:max(0, len(hit) - self.db.done_update_shortfall)]
+            self.conn.pending.extend(("done", q) for q in hit)
+            self.rowcount = len(hit)
+            return
+        raise AssertionError(f"unexpected SQL: {sql}")
+
+
+class FakeConn:
+    def __init__(self, db: FakeDB) -> None:
+        self.db = db
+        self.pending: List[tuple] = []
+        self.closed = False
+        self.pings = 0
+        self.rollbacks = 0
+        self.ping_error: Optional[Exception] = None
+
+    def cursor(self, *args):
+        return FakeCursor(self)
+
+    def begin(self) -> None:
+        self.pending.clear()
+
+    def commit(self) -> None:
+        qs = self.db.questionnaires
+        for kind, val in self.pending:
+            if kind == "claim":
+                qid, sid = val
+                qs[qid].update(status="in_progress", claimed_by=sid)
+            elif kind == "done":
+                qs[val]["status"] = "done"
+            elif kind == "insert":
+                self.db.submissions.append(val)
+        self.pending.clear()
+
+    def rollback(self) -> None:
+        self.rollbacks += 1
+        self.pending.clear()
+
+    def ping(self, reconnect: bool = False) -> None:
+        self.pings += 1
+        if self.ping_error is not None:
+            raise self.ping_error
+
+    def close(self) -> None:
+        self.closed = True
+
+
+def make_ops(db: FakeDB) -> TiDBOps:
+    ops = TiDBOps(host="h", port=4000, user="u", password="p", database="d")
+    ops.connect = lambda: FakeConn(db)  # 不连真实 TiDB
+    return ops
+
+
+class PoolTest(unittest.TestCase):
+    def setUp(self):
+        self.db = FakeDB(["q1"])
+        self.conns: List[FakeConn] = []
+        self.ops = TiDBOps(host="h", port=4000, user="u", password="p", database="d", pool_size=2)
+
+        def connect():
+            conn = FakeConn(self.db)
+            self.conns.append(conn)
+            return conn
+
+        self.ops.connect = connect
+
+    def test_reuses_pooled_connection(self):
+        self.ops.reclaim_expired(60)
+        self.ops.reclaim_expired(60)
+        self.assertEqual(len(self.conns), 1)
+        self.assertEqual(self.conns[0].pings, 0)  # 刚归还的连接不 ping
+
+    def test_operational_error_discards_connection(self):
+        with self.assertRaises(pymysql.err.OperationalError):
+            with self.ops._conn():
+                raise pymysql.err.OperationalError(2013, "Lost connection")
+        self.assertTrue(self.conns[0].closed)
+        self.ops.reclaim_expired(60)
+        self.assertEqual(len(self.conns), 2)
+
+    def test_other_error_rolls_back_and_keeps_connection(self):
+        with self.assertRaises(ValueError):
+            with self.ops._conn():
+                raise ValueError("boom")
+        self.assertEqual(self.conns[0].rollbacks, 1)
+        self.assertFalse(self.conns[0].closed)
+        self.ops.reclaim_expired(60)
+        self.assertEqual(len(self.conns), 1)
+
+    def test_idle_connection_is_pinged_and_replaced_if_dead(self):
+        self.ops.IDLE_PING_SECONDS = -1  # 任何空闲都算过久
+        self.ops.reclaim_expired(60)
+        self.ops.reclaim_expired(60)
+        self.assertEqual(self.conns[0].pings, 1)
+        self.assertEqual(len(self.conns), 1)
+
+        self.conns[0].ping_error = pymysql.err.OperationalError(2006, "gone away")
+        self.ops.reclaim_expired(60)
+        self.assertTrue(self.conns[0].closed)
+        self.assertEqual(len(self.conns), 2)
+
+
+class ClaimOneTest(unittest.TestCase):
+    def test_claims_available_without_listing_all_ids(self):
+        db = FakeDB([f"bank/questionnaire_{i:03d}.jsonl" for i in range(50)])
+        ops = make_ops(db)
+        row = ops.claim_one(sid="2024000001", ttl_seconds=60)
+        self.assertIsNotNone(row)
+        self.assertEqual(db.questionnaires[row.qid]["status"], "in_progress")
+        self.assertEqual(db.questionnaires[row.qid]["claimed_by"], "2024000001")
+        # 候选 qid 只按 LIMIT/OFFSET 取一小段，不再整表拉回
+        self.assertFalse(any(s == "SELECT qid FROM questionnaires WHERE status='available';" for s in db.statements))
+        self.assertTrue(any("LIMIT %s OFFSET %s" in s for s in db.statements))
+
+    def test_claims_each_questionnaire_once(self):
+        db = FakeDB([f"q{i}" for i in range(5)])
+        ops = make_ops(db)
+        claimed = {ops.claim_one(sid=f"{i:010d}", ttl_seconds=60).qid for i in range(5)}
+        self.assertEqual(claimed, set(db.questionnaires))
+        self.assertIsNone(ops.claim_one(sid="0000000009", ttl_seconds=60))
+
+
+class SubmitManyTest(unittest.TestCase):
+    def setUp(self):
+        self.db = FakeDB(["q1", "q2", "q3", "q4"])
+        qs = self.db.questionnaires
+        qs["q1"].update(status="in_progress", claimed_by="s1")
+        qs["q2"].update(status="in_progress", claimed_by="s2")
+        qs["q3"].update(status="done", claimed_by="s3")
+        self.ops = make_ops(self.db)
+
+    def test_rejected_rows_do_not_block_valid_ones(self):
+        results = self.ops.submit_many([
+            ("q1", "s1", {"a": "A"}),
+            ("q2", "s1", {"a": "B"}),  # 不属于 s1：拒绝
+            ("q3", "s3", {"a": "C"}),  # 已 done：幂等成功，不再写入
+            ("q4", "s4", {"a": "A"}),  # 未领取：拒绝
+            ("q1", "s1", {"a": "B"}),  # 同批重复：只写一次
+        ])
+        self.assertEqual(results, [True, False, True, False, True])
+        self.assertEqual([r[:2] for r in self.db.submissions], [("q1", "s1")])
+        self.assertEqual(json.loads(self.db.submissions[0][2]), {"a": "A"})
+        qs = self.db.questionnaires
+        self.assertEqual(qs["q1"]["status"], "done")
+        self.assertEqual(qs["q2"]["status"], "in_progress")
+        self.assertEqual(qs["q4"]["status"], "available")
+
+    def test_rowcount_mismatch_rolls_back_whole_batch(self):
+        qs = self.db.questionnaires
+        qs["q4"].update(status="in_progress", claimed_by="s4")
+        self.db.done_update_shortfall = 1
+        results = self.ops.submit_many([("q1", "s1", {"a": "A"}), ("q4", "s4", {"a": "B"})])
+        self.assertEqual(results, [False, False])
+        self.assertEqual(self.db.submissions, [])
+        self.assertEqual(qs["q1"]["status"], "in_progress")
+        self.assertEqual(qs["q4"]["status"], "in_progress")
+
+    def test_empty(self):
+        self.assertEqual(self.ops.submit_many([]), [])
+        self.assertEqual(self.db.statements, [])
+
+
+if __name__ == "__main__":
+    unittest.main()